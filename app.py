@@ -1,29 +1,254 @@
 import os
+import re
+import gzip
+import json
+import time
+import shutil
+import hashlib
+import functools
+from collections import namedtuple
+import mimetypes
 import sqlite3
-import requests  # Fallback for blob upload on PythonAnywhere
-from flask import Flask, render_template_string, request, redirect, url_for, flash, abort
+import tempfile
+import threading
+from markupsafe import Markup, escape
+from flask import Flask, Response, jsonify, render_template, request, redirect, url_for, flash, abort, send_from_directory, stream_with_context, stream_template
+from flask import g, session, has_request_context, before_render_template, template_rendered
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import OperationalError
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from werkzeug.utils import secure_filename
-from mangum import Mangum
+from werkzeug.security import safe_join
+from werkzeug.exceptions import HTTPException
+from jinja2 import FileSystemBytecodeCache
+from message_bus import create_bus
+from upload_queue import UploadQueue
+from write_batcher import WriteBatcher
+import thumbnails
+from ttl_cache import MISSING, TTLCache
+from metrics import Registry
+# requests, mangum, vercel.blob and multiprocessing are imported where first used: they are
+# slow to import, and a cold serverless start shouldn't pay for code its first request never runs
 try:
-    from vercel.blob import put  # Try Vercel SDK
+    import brotli  # Optional: adds .br variants of static assets
 except ImportError:
-    put = None  # Fallback to HTTP if not available
+    brotli = None
 
 # --- Config ---
+SERVERLESS = bool(os.getenv('AWS_LAMBDA_FUNCTION_NAME') or os.getenv('VERCEL'))  # Frozen between requests; no background threads
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev-secret')
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:////home/yourname/mysite/chat_app.db'  # PERSISTENT
-app.config['UPLOAD_FOLDER'] = '/home/yourname/mysite/uploads'  # PERSISTENT
+app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:////home/yourname/mysite/chat_app.db')  # PERSISTENT
+app.config['SQLITE_PROFILE'] = os.getenv('SQLITE_PROFILE', 'default')  # 'production' = WAL + tuned pragmas + read-only pool; local disk only (not NFS)
+app.config['SQLITE_BUSY_TIMEOUT'] = int(os.getenv('SQLITE_BUSY_TIMEOUT', 5000))  # ms to wait for the write lock before "database is locked"
+app.config['SQLITE_MIGRATION_TIMEOUT'] = int(os.getenv('SQLITE_MIGRATION_TIMEOUT', 600000))  # ms a starting worker waits for another's schema migration
+app.config['SQLITE_CACHE_SIZE'] = int(os.getenv('SQLITE_CACHE_SIZE', 64 * 1024))  # KiB of page cache per connection (production)
+app.config['SQLITE_MMAP_SIZE'] = int(os.getenv('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))  # Bytes memory-mapped per connection (production)
+app.config['SQLITE_READ_POOL_SIZE'] = int(os.getenv('SQLITE_READ_POOL_SIZE', 10))  # Read-only connections per worker (production)
+app.config['WRITE_BATCHING'] = os.getenv('WRITE_BATCHING') == '1'  # Group-commit text messages arriving close together
+app.config['WRITE_BATCH_MAX'] = int(os.getenv('WRITE_BATCH_MAX', 64))  # Messages per transaction
+app.config['WRITE_BATCH_DELAY'] = float(os.getenv('WRITE_BATCH_DELAY', 0.005))  # Seconds a batch stays open for more messages
+app.config['WRITE_BATCH_TIMEOUT'] = float(os.getenv('WRITE_BATCH_TIMEOUT', 10))  # Seconds a request waits for its batch to commit
+app.config['UPLOAD_FOLDER'] = os.getenv('UPLOAD_FOLDER', '/home/yourname/mysite/uploads')  # PERSISTENT
+app.config['UPLOAD_MODE'] = os.getenv('UPLOAD_MODE', 'inline' if SERVERLESS else 'background')  # Inline on serverless, where threads freeze after the response
+app.config['UPLOAD_QUEUE_DIR'] = os.getenv('UPLOAD_QUEUE_DIR', os.path.join(app.config['UPLOAD_FOLDER'], 'pending'))
+app.config['UPLOAD_WORKERS'] = int(os.getenv('UPLOAD_WORKERS', 2))
+app.config['UPLOAD_MAX_ATTEMPTS'] = int(os.getenv('UPLOAD_MAX_ATTEMPTS', 5))
+app.config['THUMBNAIL_WORKERS'] = int(os.getenv('THUMBNAIL_WORKERS', 2))  # Processes for preview generation
+app.config['THUMBNAIL_SIZE'] = int(os.getenv('THUMBNAIL_SIZE', 480))  # Longest preview edge in px
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file
+app.config['CHAT_PAGE_SIZE'] = int(os.getenv('CHAT_PAGE_SIZE', 50))  # Messages per chat page
+app.config['CHAT_STREAM_CHUNK'] = int(os.getenv('CHAT_STREAM_CHUNK', 20))  # Rows fetched (and bubbles sent) per chunk of a streamed chat page
+app.config['SSE_POLL_INTERVAL'] = float(os.getenv('SSE_POLL_INTERVAL', 15))  # Fallback re-check + keepalive when no bus wakeup
+app.config['SSE_MAX_DURATION'] = float(os.getenv('SSE_MAX_DURATION', 55))  # Close so the worker frees up; browser reconnects
+# An open stream occupies its worker. 'auto' holds streams open only on threaded servers (wsgi.multithread); on one-request-
+# per-worker servers (gunicorn/uWSGI sync) each stream sends what's new and closes, and the browser polls every SSE_POLL_RETRY_MS.
+# Set '1' for gevent/eventlet workers, which don't report multithread but can hold many streams.
+app.config['SSE_HOLD'] = os.getenv('SSE_HOLD', 'auto')
+app.config['SSE_POLL_RETRY_MS'] = int(os.getenv('SSE_POLL_RETRY_MS', 5000))
+app.config['MESSAGE_BUS'] = os.getenv('MESSAGE_BUS', 'local' if SERVERLESS else 'unix')  # 'unix' fans out across workers, 'local' = this process only
+app.config['MESSAGE_BUS_DIR'] = os.getenv('MESSAGE_BUS_DIR', os.path.join(app.instance_path, 'bus'))  # Socket dir shared by this deployment's workers; made 0700
+app.config['BLOB_BACKEND'] = os.getenv('BLOB_BACKEND', 'vercel' if os.getenv('BLOB_READ_WRITE_TOKEN') else 'local')  # 'local' = UPLOAD_FOLDER
+app.config['USE_X_SENDFILE'] = os.getenv('USE_X_SENDFILE') == '1'  # Let nginx/Apache send /uploads files
+app.config['BLOB_API_URL'] = os.getenv('BLOB_API_URL', 'https://blob.vercel-storage.com')
+app.config['BLOB_CHUNK_SIZE'] = int(os.getenv('BLOB_CHUNK_SIZE', 64 * 1024))  # Bytes held in memory per upload
+app.config['BLOB_POOL_SIZE'] = int(os.getenv('BLOB_POOL_SIZE', 10))  # Kept-alive connections to blob storage
+app.config['BLOB_RETRIES'] = int(os.getenv('BLOB_RETRIES', 3))
+app.config['USER_CACHE_SIZE'] = int(os.getenv('USER_CACHE_SIZE', 4096))
+app.config['USER_CACHE_TTL'] = float(os.getenv('USER_CACHE_TTL', 60))  # Bounds staleness across workers
+app.config['MEMBERSHIP_CACHE_SIZE'] = int(os.getenv('MEMBERSHIP_CACHE_SIZE', 8192))
+app.config['MEMBERSHIP_CACHE_TTL'] = float(os.getenv('MEMBERSHIP_CACHE_TTL', 300))  # Backstop if a bus invalidation is lost
+app.config['HISTORY_CACHE_SIZE'] = int(os.getenv('HISTORY_CACHE_SIZE', 2048))  # Latest chat pages kept per worker; 0 turns the cache off
+app.config['HISTORY_CACHE_BYTES'] = int(os.getenv('HISTORY_CACHE_BYTES', 32 * 1024 * 1024))  # Approximate memory cap across those pages
+app.config['HISTORY_CACHE_TTL'] = float(os.getenv('HISTORY_CACHE_TTL', 300))  # Backstop for changes the version check can't see (renames)
+app.config['USER_SEARCH_LIMIT'] = int(os.getenv('USER_SEARCH_LIMIT', 20))  # Max users per /users/search page
+app.config['RECENT_CONTACTS'] = int(os.getenv('RECENT_CONTACTS', 12))  # Contacts listed on the home page
+app.config['INBOX_SIZE'] = int(os.getenv('INBOX_SIZE', 30))  # Conversations listed on the home page
+app.config['SEARCH_PAGE_SIZE'] = int(os.getenv('SEARCH_PAGE_SIZE', 20))
+app.config['SEARCH_MAX_PAGES'] = int(os.getenv('SEARCH_MAX_PAGES', 25))  # Ranked results need OFFSET; cap how deep it goes
+app.config['METRICS_ENABLED'] = os.getenv('METRICS_ENABLED') == '1'  # Per-request SQL/render/blob timings; hooks aren't installed otherwise
+app.config['SLOW_QUERY_MS'] = float(os.getenv('SLOW_QUERY_MS', 200))  # Log statements slower than this (needs METRICS_ENABLED)
+app.config['TEMPLATE_CACHE_DIR'] = os.getenv('TEMPLATE_CACHE_DIR')  # Default: Jinja's per-user temp dir (0700, owner checked)
+app.config['LAZY_INIT'] = os.getenv('LAZY_INIT', '1' if SERVERLESS else '0') == '1'  # Schema check + dirs on the first request, not at import
+
+# --- SQLite Profile (production: WAL, one writer connection at a time, reads on a read-only pool) ---
+class RoutingSession(Session):
+    # Reads use the 'replica' bind until the session writes; from then until its transaction ends
+    # everything goes to the writer, so a request always sees its own uncommitted changes
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        engines = self._db.engines
+        if bind is None and 'replica' in engines:
+            if self._flushing or getattr(clause, 'is_dml', False) or (mapper is None and clause is None):
+                self.info['writer'] = True  # session.connection() with no hint is assumed to be for writing
+            if not self.info.get('writer'):
+                return engines['replica']
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+_db_url = make_url(app.config['SQLALCHEMY_DATABASE_URI'])
+SQLITE_PRODUCTION = (
+    app.config['SQLITE_PROFILE'] == 'production'
+    and _db_url.get_backend_name() == 'sqlite'
+    and _db_url.database not in (None, '', ':memory:')
+)
+if SQLITE_PRODUCTION:
+    # Same file opened read-only: WAL lets these read while the writer commits
+    app.config['SQLALCHEMY_BINDS'] = {'replica': {
+        'url': _db_url.set(database=f'file:{_db_url.database}', query={'mode': 'ro', 'uri': 'true'}),
+        'pool_size': app.config['SQLITE_READ_POOL_SIZE'],
+        'max_overflow': app.config['SQLITE_READ_POOL_SIZE'],
+    }}
+
+db = SQLAlchemy(app, session_options={'class_': RoutingSession})
+
+@db.event.listens_for(RoutingSession, 'after_transaction_end')
+def _release_writer(session, transaction):
+    if transaction.parent is None:
+        session.info.pop('writer', None)
+
+def _configure_sqlite(engine, writer):
+    @db.event.listens_for(engine, 'connect')
+    def _set_pragmas(dbapi_conn, record):
+        cursor = dbapi_conn.cursor()
+        cursor.execute(f"PRAGMA busy_timeout = {app.config['SQLITE_BUSY_TIMEOUT']}")
+        if SQLITE_PRODUCTION:
+            if writer:
+                cursor.execute('PRAGMA journal_mode = WAL')  # Stored in the file; readers stop blocking the writer
+                cursor.execute('PRAGMA synchronous = NORMAL')  # Safe under WAL; a power cut can only drop the last commits
+                dbapi_conn.isolation_level = None  # Transactions are begun by _begin_immediate instead
+            cursor.execute(f"PRAGMA cache_size = -{app.config['SQLITE_CACHE_SIZE']}")
+            cursor.execute(f"PRAGMA mmap_size = {app.config['SQLITE_MMAP_SIZE']}")
+            cursor.execute('PRAGMA temp_store = MEMORY')
+        cursor.close()
+
+    if SQLITE_PRODUCTION and writer:
+        @db.event.listens_for(engine, 'begin')
+        def _begin_immediate(conn):
+            # Take the write lock up front; a deferred read-then-write can fail with SQLITE_BUSY instead of waiting
+            conn.exec_driver_sql('BEGIN IMMEDIATE')
+
+with app.app_context():
+    for bind_key, engine in db.engines.items():
+        if engine.dialect.name == 'sqlite':
+            _configure_sqlite(engine, writer=bind_key != 'replica')
+
+# --- Instrumentation (per-request SQL / render / blob spans, exported on /metrics) ---
+registry = Registry()
+REQUESTS = registry.counter('chat4c_http_requests_total', 'Requests by route, method and status.', ('route', 'method', 'status'))
+REQUEST_SECONDS = registry.histogram('chat4c_http_request_duration_seconds', 'Request time until the body is fully sent.', ('route',))
+STAGE_SECONDS = registry.histogram(
+    'chat4c_stage_duration_seconds', 'Time per request spent in SQL, template rendering and blob uploads.', ('route', 'stage')
+)
+SQL_QUERIES = registry.histogram(
+    'chat4c_sql_queries_per_request', 'SQL statements executed per request.', ('route',), buckets=(1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+)
+SLOW_QUERIES = registry.counter('chat4c_sql_slow_queries_total', 'Statements slower than SLOW_QUERY_MS.', ('route',))
+
+def record_stage(stage, seconds):
+    # Inside a request: add to its spans, reported when it finishes. Elsewhere (upload/batch threads): report now
+    spans = g.get('spans') if has_request_context() else None
+    if spans is None:
+        STAGE_SECONDS.observe(('background', stage), seconds)
+    else:
+        spans[stage] = spans.get(stage, 0.0) + seconds
+
+def timed_stage(stage):
+    def decorate(fn):
+        if not app.config['METRICS_ENABLED']:
+            return fn  # Zero overhead when disabled
+
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                record_stage(stage, time.perf_counter() - start)
+        wrapper.__name__ = fn.__name__
+        return wrapper
+    return decorate
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+    record_stage('sql', elapsed)
+    route = 'background'
+    if has_request_context():
+        route = request.endpoint or 'unmatched'
+        if 'queries' in g:
+            g.queries[0] += 1
+    if elapsed * 1000 >= app.config['SLOW_QUERY_MS']:
+        SLOW_QUERIES.inc((route,))
+        app.logger.warning('Slow query (%.1f ms, %s): %s', elapsed * 1000, route, ' '.join(statement.split()))
+
+def _start_request_timer():
+    g.request_start = time.perf_counter()
+    g.spans = {}
+    g.queries = [0]  # Mutable so report() still sees statements run while a streamed body is sent
+
+def _finish_request_timer(response):
+    # Reported when the body has been sent, so streamed pages count their full rendering time
+    route = request.endpoint or 'unmatched'
+    start, spans, queries = g.request_start, g.spans, g.queries
+    REQUESTS.inc((route, request.method, str(response.status_code)))
+
+    def report():
+        REQUEST_SECONDS.observe((route,), time.perf_counter() - start)
+        SQL_QUERIES.observe((route,), queries[0])
+        for stage, seconds in spans.items():
+            STAGE_SECONDS.observe((route, stage), seconds)
+
+    response.call_on_close(report)
+    return response
+
+def _render_started(sender, template, context, **extra):
+    g.render_start = time.perf_counter()
+
+def _render_finished(sender, template, context, **extra):
+    start = g.pop('render_start', None)
+    if start is not None:
+        record_stage('render', time.perf_counter() - start)
+
+if app.config['METRICS_ENABLED']:
+    with app.app_context():
+        for engine in db.engines.values():
+            db.event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+            db.event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    app.before_request(_start_request_timer)
+    app.after_request(_finish_request_timer)
+    before_render_template.connect(_render_started, app)
+    template_rendered.connect(_render_finished, app)
 
-db = SQLAlchemy(app)
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
+bus = create_bus(app.config['MESSAGE_BUS'], app.config['MESSAGE_BUS_DIR'])
 
-# Ensure upload dir
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+# Per-page templates in templates/ are compiled once per process (Jinja's template cache);
+# the bytecode cache lets new workers skip parsing/compiling them too. Cached code is unpickled and run, so
+# the default directory is Jinja's own, which it refuses to use unless this user owns it and nobody else can write to it
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache(app.config['TEMPLATE_CACHE_DIR'])
 
 # --- Models ---
 class User(UserMixin, db.Model):
@@ -31,578 +256,739 @@ class User(UserMixin, db.Model):
     username = db.Column(db.String(150), unique=True, nullable=False)
     password = db.Column(db.String(150), nullable=False)
 
+# Case-insensitive prefix search on usernames seeks on this; id breaks ties for the search cursor
+db.Index('ix_user_username_lower', db.func.lower(User.username), User.id)
+
 class Message(db.Model):
+    # Composite indexes for each history access pattern: inbox, group chat (private chats: ix_message_pair_key)
+    __table_args__ = (
+        db.Index('ix_message_receiver_ts', 'receiver_id', 'timestamp', 'id'),
+        db.Index('ix_message_group_ts', 'group_id', 'timestamp', 'id'),
+        # Only rows still uploading, per conversation; keeps pending_media_version() a seek however large the table grows
+        db.Index('ix_message_group_pending', 'group_id', 'id', sqlite_where=db.text("media_status = 'pending'")),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     sender_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     receiver_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
     group_id = db.Column(db.Integer, db.ForeignKey('group.id'), nullable=True)
     content = db.Column(db.Text)
     media_blob_path = db.Column(db.String(500))
+    media_status = db.Column(db.String(16))  # None (no media / legacy), 'pending', 'ready', 'failed'
+    media_digest = db.Column(db.String(64), db.ForeignKey('media_object.digest'), nullable=True)
     timestamp = db.Column(db.DateTime, server_default=db.func.now())
 
     # FIXED: Relationships
     sender = db.relationship('User', foreign_keys=[sender_id], backref='sent_messages')
     receiver = db.relationship('User', foreign_keys=[receiver_id], backref='received_messages')
     group = db.relationship('Group', backref='messages')
+    media = db.relationship('MediaObject')
+
+# Private chats seek on the unordered pair, so both directions come back from one index range
+# already in (timestamp, id) order; private_history_query() filters on the same expressions
+db.Index(
+    'ix_message_pair_key',
+    db.func.min(Message.sender_id, Message.receiver_id),
+    db.func.max(Message.sender_id, Message.receiver_id),
+    Message.timestamp,
+    Message.id,
+    sqlite_where=Message.receiver_id.isnot(None),
+)
+# Arguments swapped relative to ix_message_pair_key, so only pending_media_version()'s lookup matches it
+db.Index(
+    'ix_message_pair_pending',
+    db.func.min(Message.receiver_id, Message.sender_id),
+    db.func.max(Message.receiver_id, Message.sender_id),
+    Message.id,
+    sqlite_where=db.and_(Message.receiver_id.isnot(None), db.text("media_status = 'pending'")),
+)
 
 class Group(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(150), unique=True, nullable=False)
 
+class MediaObject(db.Model):
+    # One stored blob per distinct payload; messages share it via Message.media_digest
+    digest = db.Column(db.String(64), primary_key=True)  # sha256 hex
+    url = db.Column(db.String(500), nullable=False)
+    size = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, server_default=db.func.now())
+    width = db.Column(db.Integer)  # Original dimensions, when known
+    height = db.Column(db.Integer)
+    preview_url = db.Column(db.String(500))  # Small JPEG (poster frame for video); None = use the original
+    preview_width = db.Column(db.Integer)
+    preview_height = db.Column(db.Integer)
+
 class GroupMember(db.Model):
+    # PK covers (group_id, user_id); this covers "groups of user" lookups
+    __table_args__ = (db.Index('ix_group_member_user', 'user_id', 'group_id'),)
+
     group_id = db.Column(db.Integer, db.ForeignKey('group.id'), primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
 
-@login_manager.user_loader
-def load_user(user_id):
-    return User.query.get(int(user_id))
-
-# --- Init DB on Startup ---
-with app.app_context():
-    db.create_all()
-    print("SQLite DB initialized at /home/yourname/mysite/chat_app.db")
-
-# --- Full HTML Template (UNCHANGED) ---
-NEXUS_HTML = '''<!DOCTYPE html>
-<html lang="en" data-theme="auto">
-<head>
-  <meta charset="UTF-8">
-  <meta name="viewport" content="width=device-width, initial-scale=1.0">
-  <title>Nexus Chat • {{ page_title }}</title>
-  <style>
-    @import url('https://fonts.googleapis.com/css2?family=Inter:wght@300;400;500;600;700&display=swap');
-
-    :root {
-      --font-family: 'Inter', system-ui, sans-serif;
-      font-family: var(--font-family);
-      --font-weight-light: 300;
-      --font-weight-regular: 400;
-      --font-weight-medium: 500;
-      --font-weight-semibold: 600;
-      --font-weight-bold: 700;
-
-      --type-xs: clamp(0.75rem, 0.7rem + 0.25vw, 0.875rem);
-      --type-sm: clamp(0.875rem, 0.8rem + 0.375vw, 1rem);
-      --type-base: clamp(1rem, 0.9rem + 0.5vw, 1.125rem);
-      --type-lg: clamp(1.125rem, 1rem + 0.625vw, 1.375rem);
-      --type-xl: clamp(1.25rem, 1.1rem + 0.75vw, 1.5rem);
-      --type-2xl: clamp(1.5rem, 1.3rem + 1vw, 1.875rem);
-      --type-3xl: clamp(1.875rem, 1.6rem + 1.375vw, 2.25rem);
-
-      --line-height-tight: 1.25;
-      --line-height-snug: 1.375;
-      --line-height-normal: 1.5;
-
-      --radius-sm: 0.375rem;
-      --radius-md: 0.5rem;
-      --radius-lg: 0.75rem;
-      --radius-xl: 1rem;
-      --radius-2xl: 1.5rem;
-      --radius-full: 9999px;
-
-      --spacing-0: 0;
-      --spacing-1: 0.25rem;
-      --spacing-2: 0.5rem;
-      --spacing-3: 0.75rem;
-      --spacing-4: 1rem;
-      --spacing-5: 1.25rem;
-      --spacing-6: 1.5rem;
-      --spacing-8: 2rem;
-      --spacing-12: 3rem;
-
-      --shadow-sm: 0 1px 2px 0 oklch(0% 0 0 / 0.05);
-      --shadow-md: 0 4px 6px -1px oklch(0% 0 0 / 0.1), 0 2px 4px -2px oklch(0% 0 0 / 0.1);
-      --shadow-lg: 0 10px 15px -3px oklch(0% 0 0 / 0.1), 0 4px 6px -4px oklch(0% 0 0 / 0.1);
-      --shadow-xl: 0 20px 25px -5px oklch(0% 0 0 / 0.1), 0 8px 10px -6px oklch(0% 0 0 / 0.1);
-      --shadow-2xl: 0 25px 50px -12px oklch(0% 0 0 / 0.25);
-
-      --motion-fast: 150ms;
-      --motion-normal: 250ms;
-      --motion-slow: 400ms;
-      --motion-quint: cubic-bezier(0.86, 0, 0.07, 1);
-      --motion-standard: cubic-bezier(0.2, 0, 0, 1);
-
-      --container-max-width: min(100% - 2rem, 1400px);
-      --container-padding: clamp(1rem, 4vw, 3rem);
-      --grid-gap: clamp(1rem, 2.5vw, 2rem);
-    }
-
-    :root {
-      --color-surface-0: oklch(100% 0 0);
-      --color-surface-1: oklch(99% 0.001 240);
-      --color-surface-2: oklch(97% 0.005 240);
-      --color-surface-3: oklch(95% 0.01 240);
-      --color-surface-elevated: oklch(98% 0.005 240 / 0.9);
-
-      --color-primary-100: oklch(95% 0.03 230);
-      --color-primary-200: oklch(85% 0.08 230);
-      --color-primary-300: oklch(65% 0.18 230);
-      --color-primary-400: oklch(55% 0.22 230);
-      --color-primary-500: oklch(50% 0.25 230);
-
-      --color-secondary-300: oklch(70% 0.12 170);
-      --color-danger: oklch(60% 0.25 20);
-      --color-success: oklch(65% 0.18 140);
-    }
+class Conversation(db.Model):
+    # Denormalized inbox: one summary row per (user, conversation), written with every Message insert
+    __table_args__ = (db.Index('ix_conversation_inbox', 'user_id', 'last_message_id'),)
 
-    @media (prefers-color-scheme: dark), [data-theme="dark"] {
-      :root, html[data-theme="dark"] {
-        --color-surface-0: oklch(8% 0 0);
-        --color-surface-1: oklch(12% 0.005 240);
-        --color-surface-2: oklch(16% 0.01 240);
-        --color-surface-3: oklch(20% 0.015 240);
-        --color-surface-elevated: oklch(15% 0.01 240 / 0.8);
-
-        --color-primary-100: oklch(40% 0.12 230);
-        --color-primary-200: oklch(50% 0.18 230);
-        --color-primary-300: oklch(65% 0.22 230);
-        --color-primary-400: oklch(75% 0.2 230);
-        --color-primary-500: oklch(85% 0.15 230);
-
-        --color-secondary-300: oklch(55% 0.1 170);
-        --color-danger: oklch(55% 0.22 20);
-      }
-    }
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    kind = db.Column(db.String(8), primary_key=True)  # 'private' or 'group'
+    peer_id = db.Column(db.Integer, primary_key=True)  # The other user's id, or the group's id
+    last_message_id = db.Column(db.Integer, db.ForeignKey('message.id'), nullable=False)
+    last_sender_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    last_preview = db.Column(db.String(200))  # '' = media-only message
+    last_timestamp = db.Column(db.DateTime)
+    unread_count = db.Column(db.Integer, nullable=False, default=0)
+
+# --- Cached User Loader (one query per TTL instead of one per request) ---
+class CachedUser(UserMixin):
+    # Detached snapshot of the fields requests use; safe to share across requests and threads
+    def __init__(self, user):
+        self.id = user.id
+        self.username = user.username
+
+user_cache = TTLCache(app.config['USER_CACHE_SIZE'], app.config['USER_CACHE_TTL'])
+
+def invalidate_user(user_id):
+    user_cache.invalidate(int(user_id))
+
+@db.event.listens_for(User, 'after_update')
+@db.event.listens_for(User, 'after_delete')
+def _user_changed(mapper, connection, user):
+    invalidate_user(user.id)
 
-    html[data-theme="auto"] { color-scheme: light dark; }
+@login_manager.user_loader
+def load_user(user_id):
+    user_id = int(user_id)
+    cached = user_cache.get(user_id)
+    if cached is not MISSING:
+        return cached
+    user = db.session.get(User, user_id)
+    if user is None:
+        return None
+    cached = CachedUser(user)
+    user_cache.set(user_id, cached)
+    return cached
+
+# --- Group Membership Cache (per user and per group, invalidated across workers over the bus) ---
+GroupRef = namedtuple('GroupRef', 'id name')  # Group names never change, so they're cached with the ids
+
+membership_cache = TTLCache(app.config['MEMBERSHIP_CACHE_SIZE'], app.config['MEMBERSHIP_CACHE_TTL'])
+
+def _drop_membership(payload):
+    membership_cache.invalidate(('user', payload['user']))
+    membership_cache.invalidate(('group', payload['group']))
+
+bus.listen('membership', _drop_membership)
+
+def membership_changed(group_id, user_id):
+    # Call after commit; clears this worker's entries and every other worker's
+    bus.publish('membership', {'group': group_id, 'user': user_id})
+
+def user_groups_cached(user_id):
+    bus.start()  # Make sure this worker hears invalidations before it trusts its cache
+    key = ('user', user_id)
+    groups = membership_cache.get(key)
+    if groups is MISSING:
+        rows = (
+            db.session.query(Group.id, Group.name)
+            .join(GroupMember)
+            .filter(GroupMember.user_id == user_id)
+            .order_by(Group.id)
+        )
+        groups = {row.id: GroupRef(row.id, row.name) for row in rows}
+        membership_cache.set(key, groups)
+    return groups
+
+def group_members_cached(group_id):
+    bus.start()
+    key = ('group', group_id)
+    members = membership_cache.get(key)
+    if members is MISSING:
+        members = frozenset(uid for (uid,) in db.session.query(GroupMember.user_id).filter_by(group_id=group_id))
+        membership_cache.set(key, members)
+    return members
+
+def is_member(group_id, user_id):
+    return int(group_id) in user_groups_cached(user_id)
+
+# --- Conversation Summaries (inbox rows kept current by every Message insert) ---
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+PREVIEW_LENGTH = 140
+
+@db.event.listens_for(Message, 'after_insert')
+def _update_conversations(mapper, connection, msg):
+    # Runs on the INSERT's own connection, so the summary commits or rolls back with the message
+    timestamp = db.select(Message.timestamp).where(Message.id == msg.id).scalar_subquery()
+    preview = (msg.content or '')[:PREVIEW_LENGTH]
+    if msg.group_id:
+        # Fan out to every member in one INSERT ... SELECT over group_member's primary key
+        members = db.select(
+            GroupMember.user_id,
+            db.literal('group'),
+            GroupMember.group_id,
+            db.literal(msg.id),
+            db.literal(int(msg.sender_id)),
+            db.literal(preview),
+            timestamp,
+            db.case((GroupMember.user_id == int(msg.sender_id), 0), else_=1),
+        ).where(GroupMember.group_id == int(msg.group_id))
+        stmt = sqlite_insert(Conversation).from_select(
+            ['user_id', 'kind', 'peer_id', 'last_message_id', 'last_sender_id', 'last_preview', 'last_timestamp', 'unread_count'],
+            members
+        )
+    else:
+        sender_id, receiver_id = int(msg.sender_id), int(msg.receiver_id)
+        summary = {'last_message_id': msg.id, 'last_sender_id': sender_id, 'last_preview': preview, 'last_timestamp': timestamp}
+        stmt = sqlite_insert(Conversation).values([
+            {'user_id': sender_id, 'kind': 'private', 'peer_id': receiver_id, 'unread_count': 0, **summary},
+            {'user_id': receiver_id, 'kind': 'private', 'peer_id': sender_id, 'unread_count': int(receiver_id != sender_id), **summary},
+        ])
+    connection.execute(stmt.on_conflict_do_update(
+        index_elements=['user_id', 'kind', 'peer_id'],
+        set_={
+            'last_message_id': stmt.excluded.last_message_id,
+            'last_sender_id': stmt.excluded.last_sender_id,
+            'last_preview': stmt.excluded.last_preview,
+            'last_timestamp': stmt.excluded.last_timestamp,
+            'unread_count': Conversation.unread_count + stmt.excluded.unread_count,
+        }
+    ))
+
+def rebuild_conversations(conn):
+    # Recompute every summary from history (unread counts start at 0); for upgrades and bulk-seeded databases
+    conn.exec_driver_sql('DELETE FROM conversation')
+    conn.exec_driver_sql(f'''
+        INSERT INTO conversation
+            (user_id, kind, peer_id, last_message_id, last_sender_id, last_preview, last_timestamp, unread_count)
+        SELECT latest.user_id, latest.kind, latest.peer_id, m.id, m.sender_id,
+               substr(coalesce(m.content, ''), 1, {PREVIEW_LENGTH}), m.timestamp, 0
+        FROM (
+            SELECT user_id, 'private' AS kind, peer_id, max(id) AS message_id
+            FROM (
+                SELECT sender_id AS user_id, receiver_id AS peer_id, id FROM message WHERE receiver_id IS NOT NULL
+                UNION ALL
+                SELECT receiver_id, sender_id, id FROM message WHERE receiver_id IS NOT NULL
+            )
+            GROUP BY user_id, peer_id
+            UNION ALL
+            SELECT gm.user_id, 'group', gm.group_id, latest_group.message_id
+            FROM group_member AS gm
+            JOIN (SELECT group_id, max(id) AS message_id FROM message WHERE group_id IS NOT NULL GROUP BY group_id) AS latest_group
+                ON latest_group.group_id = gm.group_id
+        ) AS latest
+        JOIN message AS m ON m.id = latest.message_id
+    ''')
+
+# --- Full-Text Search Index (FTS5 over message.content, synced by triggers on every insert path) ---
+def create_search_index(conn):
+    # Returns False when this SQLite build lacks FTS5; search is then reported as unavailable
+    try:
+        conn.exec_driver_sql(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS message_fts USING fts5("
+            "content, content='message', content_rowid='id', tokenize='unicode61 remove_diacritics 2')"
+        )
+    except OperationalError:
+        return False
+    conn.exec_driver_sql('''
+        CREATE TRIGGER IF NOT EXISTS message_fts_insert AFTER INSERT ON message BEGIN
+            INSERT INTO message_fts (rowid, content) VALUES (new.id, new.content);
+        END''')
+    conn.exec_driver_sql('''
+        CREATE TRIGGER IF NOT EXISTS message_fts_delete AFTER DELETE ON message BEGIN
+            INSERT INTO message_fts (message_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        END''')
+    conn.exec_driver_sql('''
+        CREATE TRIGGER IF NOT EXISTS message_fts_update AFTER UPDATE OF content ON message BEGIN
+            INSERT INTO message_fts (message_fts, rowid, content) VALUES ('delete', old.id, old.content);
+            INSERT INTO message_fts (rowid, content) VALUES (new.id, new.content);
+        END''')
+    return True
+
+def has_search_index(conn):
+    return conn.exec_driver_sql("SELECT 1 FROM sqlite_master WHERE name = 'message_fts'").scalar() is not None
+
+@app.cli.command('rebuild-search')
+def rebuild_search_command():
+    """Create the message search index if needed and rebuild it from existing messages."""
+    initialize()
+    with db.engine.begin() as conn:
+        if not create_search_index(conn):
+            print('This SQLite build has no FTS5; search stays disabled.')
+            return
+        conn.exec_driver_sql("INSERT INTO message_fts(message_fts) VALUES ('rebuild')")
+        count = conn.exec_driver_sql('SELECT count(*) FROM message').scalar()
+    print(f'Search index rebuilt for {count} messages.')
+
+# --- Schema Migrations (version stored in SQLite PRAGMA user_version) ---
+def _add_column(conn, table, column, ddl):
+    # Tables created by an earlier step's create() already have the latest columns
+    if column not in {row[1] for row in conn.exec_driver_sql(f'PRAGMA table_info("{table}")')}:
+        conn.exec_driver_sql(f'ALTER TABLE "{table}" ADD COLUMN {column} {ddl}')
+
+def _create_indexes(conn, table, *names):
+    # Listed by name: a table's later indexes may need columns an earlier step predates. Checked against
+    # sqlite_master, since reflection (checkfirst) can't see expression indexes.
+    existing = {name for (name,) in conn.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    for index in table.indexes:
+        if index.name in names and index.name not in existing:
+            index.create(conn)
+
+def _migrate_v1_indexes(conn):
+    _create_indexes(conn, Message.__table__, 'ix_message_receiver_ts', 'ix_message_group_ts', 'ix_message_pair_key')
+    _create_indexes(conn, GroupMember.__table__, 'ix_group_member_user')
+
+def _migrate_v2_media_status(conn):
+    _add_column(conn, 'message', 'media_status', 'VARCHAR(16)')
+    _create_indexes(conn, Message.__table__, 'ix_message_group_pending', 'ix_message_pair_pending')
+
+def _migrate_v3_media_objects(conn):
+    MediaObject.__table__.create(conn, checkfirst=True)
+    _add_column(conn, 'message', 'media_digest', 'VARCHAR(64) REFERENCES media_object (digest)')
+
+def _migrate_v4_media_previews(conn):
+    for column, ddl in (('width', 'INTEGER'), ('height', 'INTEGER'), ('preview_url', 'VARCHAR(500)'),
+                        ('preview_width', 'INTEGER'), ('preview_height', 'INTEGER')):
+        _add_column(conn, 'media_object', column, ddl)
+
+def _migrate_v5_username_search(conn):
+    _create_indexes(conn, User.__table__, 'ix_user_username_lower')
+
+def _migrate_v6_conversations(conn):
+    Conversation.__table__.create(conn, checkfirst=True)
+    rebuild_conversations(conn)
+
+def _migrate_v7_search_index(conn):
+    if create_search_index(conn):
+        conn.exec_driver_sql("INSERT INTO message_fts(message_fts) VALUES ('rebuild')")
+
+# Append new steps only; schema version N means MIGRATIONS[:N] have been applied
+MIGRATIONS = [
+    _migrate_v1_indexes,
+    _migrate_v2_media_status,
+    _migrate_v3_media_objects,
+    _migrate_v4_media_previews,
+    _migrate_v5_username_search,
+    _migrate_v6_conversations,
+    _migrate_v7_search_index,
+]
+
+def migrate_db():
+    with db.engine.connect() as conn:
+        dbapi_conn = conn.connection.dbapi_connection  # Used directly where SQLAlchemy would begin a transaction
+        if dbapi_conn.execute('PRAGMA user_version').fetchone()[0] == len(MIGRATIONS):
+            return len(MIGRATIONS)  # Already current: no write lock, create_all inspection or version write
+        # Workers starting together on one file would each run the steps (pysqlite runs DDL outside any
+        # transaction): hold the write lock throughout, waiting out another worker's migration, and re-read
+        # the version under it
+        dbapi_conn.execute(f"PRAGMA busy_timeout = {app.config['SQLITE_MIGRATION_TIMEOUT']}")
+        try:
+            with conn.begin():
+                if not dbapi_conn.in_transaction:
+                    conn.exec_driver_sql('BEGIN IMMEDIATE')  # The production profile's writer has already begun one
+                version = conn.exec_driver_sql('PRAGMA user_version').scalar()
+                if version == len(MIGRATIONS):
+                    return version
+                if version == 0 and not db.inspect(conn).has_table('message'):
+                    # Fresh database: create_all already builds the latest schema
+                    db.metadata.create_all(conn)
+                    create_search_index(conn)  # Virtual table + triggers aren't part of the metadata
+                else:
+                    for step in MIGRATIONS[version:]:
+                        step(conn)
+                    db.metadata.create_all(conn)  # Tables added since the last migration
+                conn.exec_driver_sql(f'PRAGMA user_version = {len(MIGRATIONS)}')
+                return version
+        finally:
+            dbapi_conn.execute(f"PRAGMA busy_timeout = {app.config['SQLITE_BUSY_TIMEOUT']}")
+
+# --- Init DB on Startup (or on the first request with LAZY_INIT) ---
+SEARCH_ENABLED = False
+_initialized = False
+_init_lock = threading.Lock()
+
+def initialize():
+    # Once per process; concurrent cold starts on a shared database are safe (migrate_db holds the write lock)
+    global SEARCH_ENABLED, _initialized
+    if _initialized:
+        return
+    with _init_lock:
+        if _initialized:
+            return
+        for folder in ('UPLOAD_FOLDER', 'UPLOAD_QUEUE_DIR'):
+            os.makedirs(app.config[folder], exist_ok=True)
+        if app.config['TEMPLATE_CACHE_DIR']:
+            os.makedirs(app.config['TEMPLATE_CACHE_DIR'], mode=0o700, exist_ok=True)
+        with app.app_context():
+            from_version = migrate_db()
+            with db.engine.connect() as conn:
+                SEARCH_ENABLED = has_search_index(conn)
+        print(f"SQLite DB initialized at {app.config['SQLALCHEMY_DATABASE_URI']} (schema v{from_version} -> v{len(MIGRATIONS)})")
+        _initialized = True
+
+if app.config['LAZY_INIT']:
+    app.before_request(initialize)
+else:
+    initialize()
 
-    :root { --gradient-primary: linear-gradient(135deg, var(--color-primary-300), var(--color-primary-500)); }
+# --- Routes ---
+from sqlalchemy import or_
+from sqlalchemy.orm import aliased, joinedload
+
+# --- Keyset Pagination (cursor = id of the oldest message shown; seek on its (timestamp, id)) ---
+def keyset_page_query(query, before=None, limit=None):
+    # Newest page first via (timestamp, id) DESC + LIMIT; no OFFSET, so cost is flat with history size
+    if before is not None:
+        pivot_ts = db.select(Message.timestamp).where(Message.id == before).scalar_subquery()
+        # (timestamp, id) < (pivot_ts, before), with the <= bound kept separate so it seeks on the index
+        query = query.filter(
+            Message.timestamp <= pivot_ts,
+            or_(Message.timestamp < pivot_ts, Message.id < before)
+        )
+    return query.order_by(Message.timestamp.desc(), Message.id.desc()).limit(limit + 1)
+
+def paginate_messages(query, before=None, limit=None):
+    limit = limit or app.config['CHAT_PAGE_SIZE']
+    rows = keyset_page_query(query, before, limit).all()
+    older_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        older_cursor = rows[-1].id
+    rows.reverse()
+    return rows, older_cursor
+
+def stream_messages(query, before=None, limit=None):
+    # Same page as paginate_messages without loading it up front: an id-only seek finds the page and
+    # its cursors, then rows are read oldest-first from a cursor CHAT_STREAM_CHUNK at a time while
+    # the template renders. Returns (rows iterable, older_cursor, newest_id).
+    limit = limit or app.config['CHAT_PAGE_SIZE']
+    ids = [row.id for row in keyset_page_query(query.with_entities(Message.id), before, limit)]
+    older_cursor = ids[limit - 1] if len(ids) > limit else None
+    ids = ids[:limit]
+    rows = (
+        Message.query.filter(Message.id.in_(ids))
+        .options(joinedload(Message.sender), joinedload(Message.media))
+        .order_by(Message.timestamp, Message.id)
+        .yield_per(app.config['CHAT_STREAM_CHUNK'])
+    )
+    return rows, older_cursor, ids[0] if ids else None
+
+# --- History Queries (each backed by a Message composite index) ---
+def private_history_query(user_id, other_id):
+    low, high = sorted((int(user_id), int(other_id)))
+    return Message.query.filter(
+        Message.receiver_id.isnot(None),
+        db.func.min(Message.sender_id, Message.receiver_id) == low,
+        db.func.max(Message.sender_id, Message.receiver_id) == high,
+    )
 
-    .nexus-container { max-width: var(--container-max-width); margin-inline: auto; padding-inline: var(--container-padding); }
+def group_history_query(group_id):
+    return Message.query.filter_by(group_id=group_id)
+
+# --- Streamed Pages (first bytes go out before the history is read) ---
+# Templates put {{ stream_flush }} wherever the page should be sent so far: after the header and
+# input bar, and before each database fetch inside the message loop
+STREAM_FLUSH = Markup('<!--flush-->')
+app.jinja_env.globals['stream_flush'] = STREAM_FLUSH
+
+def stream_page(template_name, **context):
+    def chunks(pieces):
+        # Jinja yields many tiny strings; send them joined, one chunk per flush mark (marks dropped)
+        buffer = []
+        for piece in pieces:
+            if piece == STREAM_FLUSH:
+                if buffer:
+                    yield ''.join(buffer)
+                buffer = []
+            else:
+                buffer.append(piece)
+        if buffer:
+            yield ''.join(buffer)
+    return Response(chunks(stream_template(template_name, **context)), mimetype='text/html')
+
+# --- Conditional GET (pages revalidate against a version lookup instead of re-rendering) ---
+_page_version = None
+
+def page_version():
+    # Templates and static files change only on deploy: hash them once so a deploy invalidates every ETag
+    global _page_version
+    if _page_version is None or app.debug:
+        digest = hashlib.sha1()
+        for folder in (os.path.join(app.root_path, app.template_folder), app.static_folder):
+            for root, dirs, files in os.walk(folder):
+                dirs.sort()
+                for name in sorted(files):
+                    with open(os.path.join(root, name), 'rb') as fh:
+                        digest.update(name.encode() + fh.read())
+        _page_version = digest.hexdigest()
+    return _page_version
+
+def conversation_version(user_id, kind, peer_id):
+    # Newest message in the conversation, by primary key on its summary row
+    row = (
+        db.session.query(Conversation.last_message_id, Conversation.last_timestamp)
+        .filter_by(user_id=user_id, kind=kind, peer_id=peer_id)
+        .first()
+    )
+    return row or (0, None)
+
+def inbox_version(user_id):
+    # New messages raise the max id; reading a conversation lowers the unread sum
+    return (
+        db.session.query(
+            db.func.max(Conversation.last_message_id),
+            db.func.sum(Conversation.unread_count),
+            db.func.max(Conversation.last_timestamp)
+        )
+        .filter(Conversation.user_id == user_id)
+        .one()
+    )
 
-    .nexus-grid { display: grid; gap: var(--grid-gap); grid-template-columns: 1fr; }
-    @container (min-width: 640px) { .nexus-grid { grid-template-columns: repeat(8, 1fr); } }
-    @container (min-width: 1024px) { .nexus-grid { grid-template-columns: repeat(12, 1fr); } }
-    @container (min-width: 1440px) { .nexus-grid { grid-template-columns: 300px 1fr 300px; } }
+def pending_media_query(user_id, kind, peer_id):
+    # Literal status so SQLite can use the partial indexes
+    query = db.session.query(db.func.count(), db.func.max(Message.id)).filter(db.text("message.media_status = 'pending'"))
+    if kind == 'group':
+        query = query.filter(Message.group_id == peer_id)
+    else:
+        # ix_message_pair_pending's expressions; with ix_message_pair_key's, the planner may walk the pair's whole history
+        low, high = sorted((int(user_id), int(peer_id)))
+        query = query.filter(
+            Message.receiver_id.isnot(None),
+            db.func.min(Message.receiver_id, Message.sender_id) == low,
+            db.func.max(Message.receiver_id, Message.sender_id) == high,
+        )
+    return query
+
+def pending_media_version(user_id, kind, peer_id):
+    # Changes whenever an upload in this conversation starts, finishes or fails, so pages showing
+    # "Uploading media..." never revalidate to a stale copy
+    return tuple(pending_media_query(user_id, kind, peer_id).one())
+
+def page_etag(*version):
+    # Strong validator per viewer and URL (cursor, query string) for this deploy and data version
+    key = repr((current_user.id, request.full_path, page_version(), version))
+    return hashlib.sha1(key.encode()).hexdigest()
+
+def with_validators(response, etag, last_modified=None):
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.headers['Cache-Control'] = 'private, no-cache'  # Per-user page: browsers may keep it, but must revalidate
+    return response
+
+def not_modified(etag, last_modified=None):
+    # 304 only on a matching If-None-Match; Last-Modified alone can't see read-state or upload changes
+    if request.if_none_match.contains(etag):
+        return with_validators(Response(status=304), etag, last_modified)
+    return None
+
+# --- Recent History Cache (latest page per conversation, checked against its summary row on every read) ---
+CachedSender = namedtuple('CachedSender', 'id username')
+CachedMedia = namedtuple('CachedMedia', 'preview_url preview_width preview_height')
+CachedMessage = namedtuple(
+    'CachedMessage', 'id sender_id receiver_id group_id sender content media_blob_path media_status media timestamp'
+)
+# messages oldest first; pending is the pending_media_version() it was read under if any of them
+# was still uploading, else None (finished uploads never change again)
+HistoryWindow = namedtuple('HistoryWindow', 'last_message_id pending messages older_cursor')
+
+def snapshot_message(msg):
+    # Detached copy of what the chat templates and message_payload read; safe to share across requests
+    media = msg.media
+    return CachedMessage(
+        msg.id, msg.sender_id, msg.receiver_id, msg.group_id,
+        CachedSender(msg.sender.id, msg.sender.username),
+        msg.content, msg.media_blob_path, msg.media_status,
+        CachedMedia(media.preview_url, media.preview_width, media.preview_height) if media else None,
+        msg.timestamp,
+    )
 
-    .nexus-header {
-      display: flex; justify-content: space-between; align-items: center;
-      padding: var(--spacing-4) 0; border-bottom: 1px solid var(--color-surface-3);
-      margin-bottom: var(--spacing-6);
-    }
+def _window_bytes(window):
+    # Rough: fixed per-message overhead plus the variable-length strings
+    return sum(300 + len(m.content or '') + len(m.media_blob_path or '') for m in window.messages)
+
+history_cache = TTLCache(
+    app.config['HISTORY_CACHE_SIZE'],
+    app.config['HISTORY_CACHE_TTL'],
+    weigher=_window_bytes,
+    maxweight=app.config['HISTORY_CACHE_BYTES'],
+)
+
+def recent_messages(query, channel, version, before=None):
+    # stream_messages() with the latest page kept in history_cache. version = (last_message_id,
+    # pending_media_version()) as read before the page; a window is served only while both still
+    # match, so a write from any worker retires it without an invalidation message.
+    if before is not None or not app.config['HISTORY_CACHE_SIZE']:
+        return stream_messages(query, before)
+    last_message_id, pending = version
+    window = history_cache.get(
+        channel,
+        valid=lambda w: w.last_message_id == last_message_id and w.pending in (None, pending)
+    )
+    if window is not MISSING:
+        return window.messages, window.older_cursor, window.messages[-1].id if window.messages else None
+    rows, older_cursor, newest_id = stream_messages(query)
+
+    def fill():
+        # Snapshot rows as they stream; the window is kept only if the page was read to the end
+        messages = []
+        for msg in rows:
+            messages.append(snapshot_message(msg))
+            yield messages[-1]
+        uploading = any(m.media_status == 'pending' for m in messages)
+        history_cache.set(channel, HistoryWindow(last_message_id, pending if uploading else None, tuple(messages), older_cursor))
+    return fill(), older_cursor, newest_id
+
+# --- Inbox (reads the Conversation summaries, never Message history) ---
+def inbox_conversations(user_id, limit):
+    # One seek on ix_conversation_inbox; names come from primary-key joins in the same statement
+    peer = aliased(User)
+    sender = aliased(User)
+    return (
+        db.session.query(Conversation, peer.username, Group.name, sender.username)
+        .outerjoin(peer, (Conversation.kind == 'private') & (peer.id == Conversation.peer_id))
+        .outerjoin(Group, (Conversation.kind == 'group') & (Group.id == Conversation.peer_id))
+        .outerjoin(sender, sender.id == Conversation.last_sender_id)
+        .filter(Conversation.user_id == user_id)
+        .order_by(Conversation.last_message_id.desc())
+        .limit(limit)
+        .all()
+    )
 
-    .nexus-card {
-      background: var(--color-surface-1); border-radius: var(--radius-xl);
-      padding: var(--spacing-6); border: 1px solid var(--color-surface-3);
-      transition: all var(--motion-normal) var(--motion-quint);
-    }
-    .nexus-card.elevated { box-shadow: var(--shadow-lg); backdrop-filter: blur(12px); }
-    .nexus-card.filled { background: var(--color-surface-2); }
-    .nexus-card.outlined { background: transparent; }
-    .nexus-card:hover { transform: translateY(-4px); box-shadow: var(--shadow-xl); }
-
-    .nexus-button {
-      display: inline-flex; align-items: center; justify-content: center;
-      gap: var(--spacing-2); font-weight: var(--font-weight-semibold);
-      font-size: var(--type-base); line-height: var(--line-height-snug);
-      border-radius: var(--radius-full); padding: var(--spacing-3) var(--spacing-5);
-      cursor: pointer; position: relative; overflow: hidden; border: none;
-      transition: all var(--motion-normal) var(--motion-quint);
-    }
-    .nexus-button.primary { background: var(--gradient-primary); color: white; box-shadow: 0 4px 12px oklch(50% .25 230 / .3); }
-    .nexus-button.secondary { background: var(--color-secondary-300); color: white; }
-    .nexus-button.ghost { background: transparent; color: var(--color-primary-300); }
-    .nexus-button.destructive { background: var(--color-danger); color: white; }
-    .nexus-button:hover { transform: translateY(-1px); box-shadow: 0 8px 16px oklch(0% 0 0 / .2); }
-    .nexus-button:active { transform: translateY(0); transition-duration: var(--motion-fast); }
-
-    .nexus-button .ripple {
-      position: absolute; border-radius: 50%;
-      background: radial-gradient(circle at center, oklch(100% 0 0 / .2) 0%, transparent 70%);
-      transform: scale(0); animation: ripple 600ms var(--motion-standard) forwards;
-      pointer-events: none;
-    }
-    @keyframes ripple { to { transform: scale(4); opacity: 0; } }
-
-    .nexus-input, .nexus-textarea {
-      width: 100%; padding: var(--spacing-4); font-size: var(--type-base);
-      line-height: var(--line-height-normal); border-radius: var(--radius-lg);
-      border: 1px solid var(--color-surface-3); background: var(--color-surface-1);
-      color: var(--color-primary-500); transition: all var(--motion-normal) var(--motion-standard);
-      outline: none;
-    }
-    .nexus-textarea { resize: vertical; min-height: 100px; }
-    .nexus-input:focus, .nexus-textarea:focus {
-      border-color: var(--color-primary-300);
-      box-shadow: 0 0 0 3px oklch(65% .18 230 / .2);
-      background: var(--color-surface-0);
-    }
+def mark_read(user_id, kind, peer_id):
+    # Read first so viewing an already-read conversation never takes the write lock
+    key = {'user_id': user_id, 'kind': kind, 'peer_id': peer_id}
+    if db.session.query(Conversation.unread_count).filter_by(**key).scalar():
+        Conversation.query.filter_by(**key).update({'unread_count': 0})
+        db.session.commit()
 
-    .nexus-chat-layout {
-      display: grid; grid-template-rows: auto 1fr auto; height: 100dvh;
-    }
+# --- User Directory (prefix search + recent contacts; never loads the whole user table) ---
+def search_users(prefix, after=None, limit=20, exclude_id=None):
+    # 'ab' matches lower(username) in ['ab', 'ab\U0010ffff'): a range seek on ix_user_username_lower.
+    # Lowercasing happens in SQL so the bounds use the same folding as the index.
+    key = db.func.lower(User.username)
+    query = db.session.query(User.id, User.username).filter(
+        key >= db.func.lower(prefix),
+        key < db.func.lower(prefix + '\U0010ffff')
+    )
+    if exclude_id is not None:
+        query = query.filter(User.id != exclude_id)
+    if after is not None:
+        # Cursor = id of the last user on the previous page; seek past its (lower(username), id)
+        pivot = db.select(key).where(User.id == after).scalar_subquery()
+        query = query.filter(key >= pivot, or_(key > pivot, User.id > after))
+    rows = query.order_by(key, User.id).limit(limit + 1).all()
+    next_cursor = rows[limit - 1].id if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+def recent_contacts(user_id, limit=12):
+    # Most recently active private conversations, read off the inbox index
+    return (
+        db.session.query(User.id, User.username)
+        .join(Conversation, User.id == Conversation.peer_id)
+        .filter(Conversation.user_id == user_id, Conversation.kind == 'private', Conversation.peer_id != user_id)
+        .order_by(Conversation.last_message_id.desc())
+        .limit(limit)
+        .all()
+    )
 
-    .nexus-message-list {
-      display: flex; flex-direction: column; gap: var(--spacing-4);
-      padding: var(--spacing-4); overflow-y: auto; scroll-behavior: smooth;
-      max-height: 100%;
-    }
-    .nexus-message { display: flex; flex-direction: column; }
-    .nexus-message.outgoing { align-items: flex-end; }
-    .nexus-message.incoming { align-items: flex-start; }
-    .nexus-bubble {
-      max-width: 75%; padding: var(--spacing-3) var(--spacing-4);
-      border-radius: var(--radius-lg); background: var(--color-surface-2);
-      color: var(--color-primary-500);
-      animation: slide-fade-in .3s var(--motion-quint) forwards;
-    }
-    .nexus-message.outgoing .nexus-bubble { background: var(--gradient-primary); color: white; }
-    .nexus-timestamp {
-      font-size: var(--type-xs); color: oklch(60% 0.1 240 / 0.7);
-      margin-top: var(--spacing-1); align-self: flex-end;
-    }
-    .nexus-media-preview { margin-top: var(--spacing-2); border-radius: var(--radius-md); overflow: hidden; }
-    .nexus-media-preview img, .nexus-media-preview video { max-width: 100%; border-radius: var(--radius-md); }
+# --- Live Update Channels (one bus channel per conversation) ---
+def private_channel(user_a, user_b):
+    low, high = sorted((int(user_a), int(user_b)))
+    return f'private:{low}-{high}'
 
-    .nexus-input-bar {
-      display: flex; gap: var(--spacing-2); padding: var(--spacing-4);
-      background: var(--color-surface-1); border-top: 1px solid var(--color-surface-3);
-    }
-    .nexus-input-bar .nexus-textarea { flex: 1; min-height: 48px; }
-    .nexus-file-input { display: none; }
+def group_channel(group_id):
+    return f'group:{group_id}'
 
-    @keyframes slide-fade-in {
-      from { opacity: 0; transform: translateY(8px) scale(0.98); }
-      to { opacity: 1; transform: translateY(0) scale(1); }
-    }
+def message_channel(msg):
+    if msg.group_id:
+        return group_channel(msg.group_id)
+    return private_channel(msg.sender_id, msg.receiver_id)
 
-    .nexus-type-2xl { font-size: var(--type-2xl); }
-    .nexus-type-xl { font-size: var(--type-xl); }
-    .nexus-type-lg { font-size: var(--type-lg); }
-    .nexus-type-3xl { font-size: var(--type-3xl); }
-    .nexus-link { color: var(--color-primary-300); text-decoration: none; }
-    .nexus-link:hover { text-decoration: underline; }
-    .nexus-chip { display: inline-block; padding: var(--spacing-2) var(--spacing-3); background: var(--color-surface-2); border-radius: var(--radius-full); font-size: var(--type-sm); }
-    .nexus-list { list-style: none; padding: 0; margin: 0; }
-    .nexus-list li { margin-bottom: var(--spacing-2); }
-  </style>
-</head>
-<body>
-
-  <!-- LOGIN -->
-  {% if page == 'login' %}
-  <div style="min-height:100dvh; display:flex; align-items:center; justify-content:center; background:var(--color-surface-0);">
-    <div class="nexus-card elevated" style="max-width:400px; width:100%;">
-      <h1 class="nexus-type-3xl" style="text-align:center; margin-bottom:var(--spacing-6);">Login</h1>
-      <form action="{{ url_for('login') }}" method="post">
-        <input type="text" name="username" class="nexus-input" placeholder="Username" required>
-        <input type="password" name="password" class="nexus-input" placeholder="Password" required>
-        <button type="submit" class="nexus-button primary" style="width:100%; margin-top:var(--spacing-4);">Login</button>
-      </form>
-      <p style="text-align:center; margin-top:var(--spacing-4);">
-        <a href="{{ url_for('register') }}" class="nexus-link">Don't have an account? Register</a>
-      </p>
-    </div>
-  </div>
-  {% endif %}
-
-  <!-- REGISTER -->
-  {% if page == 'register' %}
-  <div style="min-height:100dvh; display:flex; align-items:center; justify-content:center; background:var(--color-surface-0);">
-    <div class="nexus-card elevated" style="max-width:400px; width:100%;">
-      <h1 class="nexus-type-3xl" style="text-align:center; margin-bottom:var(--spacing-6);">Register</h1>
-      <form action="{{ url_for('register') }}" method="post">
-        <input type="text" name="username" class="nexus-input" placeholder="Username" required>
-        <input type="password" name="password" class="nexus-input" placeholder="Password" required>
-        <button type="submit" class="nexus-button primary" style="width:100%; margin-top:var(--spacing-4);">Register</button>
-      </form>
-      <p style="text-align:center; margin-top:var(--spacing-4);">
-        <a href="{{ url_for('login') }}" class="nexus-link">Already have an account? Login</a>
-      </p>
-    </div>
-  </div>
-  {% endif %}
-
-  <!-- HOME -->
-  {% if page == 'home' %}
-  <div class="nexus-container">
-    <header class="nexus-header">
-      <h1 class="nexus-type-2xl">Welcome, {{ current_user.username }}</h1>
-      <a href="{{ url_for('logout') }}" class="nexus-button ghost">Logout</a>
-    </header>
-
-    {% with messages = get_flashed_messages(with_categories=true) %}
-      {% if messages %}
-        <div style="margin-bottom: var(--spacing-6);">
-          {% for category, msg in messages %}
-            <div class="nexus-card outlined {{ category }}" style="margin-bottom: var(--spacing-2);">{{ msg }}</div>
-          {% endfor %}
-        </div>
-      {% endif %}
-    {% endwith %}
-
-    <div class="nexus-grid home">
-      <section class="nexus-card elevated">
-        <h2 class="nexus-type-lg">Send Private Message</h2>
-        <p>Select a user from "All Users" below.</p>
-      </section>
-
-      <section class="nexus-card elevated">
-        <h2 class="nexus-type-lg">Create Group</h2>
-        <form action="{{ url_for('create_group') }}" method="post">
-          <input type="text" name="group_name" class="nexus-input" placeholder="Group Name" required>
-          <button type="submit" class="nexus-button primary">Create</button>
-        </form>
-      </section>
-
-      <section class="nexus-card filled">
-        <h2 class="nexus-type-lg">Your Groups</h2>
-        <ul class="nexus-list">
-          {% for group in user_groups %}
-            <li><a href="{{ url_for('group_chat', group_id=group.id) }}" class="nexus-link">{{ group.name }}</a></li>
-          {% else %}
-            <li>No groups yet.</li>
-          {% endfor %}
-        </ul>
-      </section>
-
-      <section class="nexus-card filled">
-        <h2 class="nexus-type-lg">Join Group</h2>
-        <form action="{{ url_for('join_group') }}" method="post">
-          <input type="text" name="group_name" class="nexus-input" placeholder="Group Name" required>
-          <button type="submit" class="nexus-button secondary">Join</button>
-        </form>
-      </section>
-
-      <section class="nexus-card outlined" style="grid-column: 1 / -1;">
-        <h2 class="nexus-type-lg">All Users</h2>
-        <div style="display:flex; flex-wrap:wrap; gap: var(--spacing-2);">
-          {% for user in all_users %}
-            {% if user.id != current_user.id %}
-              <a href="{{ url_for('private_chat', receiver_id=user.id) }}" class="nexus-chip">{{ user.username }}</a>
-            {% endif %}
-          {% endfor %}
-        </div>
-      </section>
-
-      <section class="nexus-card outlined" style="grid-column: 1 / -1;">
-        <h2 class="nexus-type-lg">Recent Messages</h2>
-        <ul class="nexus-message-list">
-          {% for msg in received_messages %}
-            <li class="nexus-message incoming">
-              <div class="nexus-bubble">
-                <strong>{{ msg.sender.username }}</strong>
-                <p style="white-space: pre-wrap; margin: var(--spacing-1) 0;">{{ msg.content }}</p>
-                {% if msg.media_blob_path %}
-                  <div class="nexus-media-preview">
-                    {% set ext = msg.media_blob_path.split('.')[-1].lower() %}
-                    {% if ext in ['png','jpg','jpeg','gif'] %}
-                      <img src="{{ msg.media_blob_path }}" alt="Image">
-                    {% elif ext in ['mp4','webm'] %}
-                      <video controls style="max-width:100%;"><source src="{{ msg.media_blob_path }}"></video>
-                    {% elif ext in ['mp3','wav'] %}
-                      <audio controls style="width:100%;"><source src="{{ msg.media_blob_path }}"></audio>
-                    {% else %}
-                      <a href="{{ msg.media_blob_path }}" target="_blank">Download {{ msg.media_blob_path.split('/')[-1] }}</a>
-                    {% endif %}
-                  </div>
-                {% endif %}
-                <span class="nexus-timestamp">{{ msg.timestamp.strftime('%H:%M') }}</span>
-              </div>
-            </li>
-          {% else %}
-            <li>No messages yet.</li>
-          {% endfor %}
-        </ul>
-      </section>
-    </div>
-  </div>
-  {% endif %}
-
-  <!-- GROUPS -->
-  {% if page == 'groups' %}
-  <div class="nexus-container">
-    <header class="nexus-header">
-      <h1 class="nexus-type-2xl">Your Groups</h1>
-      <a href="{{ url_for('home') }}" class="nexus-button ghost">Back</a>
-    </header>
-
-    <div class="nexus-grid">
-      {% for group in groups %}
-        <div class="nexus-card filled">
-          <h3 class="nexus-type-lg">#{{ group.name }}</h3>
-          <p>{{ group.group_members|length }} members</p>
-          <a href="{{ url_for('group_chat', group_id=group.id) }}" class="nexus-button primary">Open Chat</a>
-        </div>
-      {% else %}
-        <div class="nexus-card outlined" style="grid-column: 1 / -1; text-align:center;">
-          <p>No groups yet. <a href="{{ url_for('home') }}" class="nexus-link">Create or join one</a>.</p>
-        </div>
-      {% endfor %}
-    </div>
-  </div>
-  {% endif %}
-
-  <!-- PRIVATE CHAT -->
-  {% if page == 'private_chat' %}
-  <div class="nexus-chat-layout">
-    <header class="nexus-header">
-      <h1 class="nexus-type-xl">Chat with {{ receiver.username }}</h1>
-      <a href="{{ url_for('home') }}" class="nexus-button ghost">Back</a>
-    </header>
-
-    <main class="nexus-message-list" id="messages">
-      {% for msg in messages %}
-        <div class="nexus-message {% if msg.sender.id == current_user.id %}outgoing{% else %}incoming{% endif %}">
-          <div class="nexus-bubble">
-            <p style="white-space: pre-wrap; margin: var(--spacing-1) 0;">{{ msg.content }}</p>
-            {% if msg.media_blob_path %}
-              <div class="nexus-media-preview">
-                {% set ext = msg.media_blob_path.split('.')[-1].lower() %}
-                {% if ext in ['png','jpg','jpeg','gif'] %}
-                  <img src="{{ msg.media_blob_path }}" alt="Media">
-                {% elif ext in ['mp4','webm'] %}
-                  <video controls style="max-width:100%;"><source src="{{ msg.media_blob_path }}"></video>
-                {% elif ext in ['mp3','wav'] %}
-                  <audio controls style="width:100%;"><source src="{{ msg.media_blob_path }}"></audio>
-                {% else %}
-                  <a href="{{ msg.media_blob_path }}" target="_blank">Open File</a>
-                {% endif %}
-              </div>
-            {% endif %}
-            <span class="nexus-timestamp">{{ msg.timestamp.strftime('%H:%M') }}</span>
-          </div>
-        </div>
-      {% endfor %}
-    </main>
-
-    <form class="nexus-input-bar" action="{{ url_for('send_message') }}" method="post" enctype="multipart/form-data">
-      <input type="hidden" name="chat_type" value="private">
-      <input type="hidden" name="receiver_id" value="{{ receiver.id }}">
-      <textarea name="content" class="nexus-textarea" placeholder="Type a message..." required></textarea>
-      <label class="nexus-button ghost" style="cursor:pointer;">
-        Attach <input type="file" name="media" class="nexus-file-input">
-      </label>
-      <button type="submit" class="nexus-button primary">Send</button>
-      <button type="button" class="nexus-button ghost" onclick="pasteFromClipboard()">Paste</button>
-    </form>
-  </div>
-  {% endif %}
-
-  <!-- GROUP CHAT -->
-  {% if page == 'group_chat' %}
-  <div class="nexus-chat-layout">
-    <header class="nexus-header">
-      <h1 class="nexus-type-xl">#{{ group.name }}</h1>
-      <a href="{{ url_for('groups') }}" class="nexus-button ghost">Back</a>
-    </header>
-
-    <main class="nexus-message-list" id="group-messages">
-      {% for msg in messages %}
-        <div class="nexus-message incoming">
-          <div class="nexus-bubble">
-            <strong>{{ msg.sender.username }}</strong>
-            <p style="white-space: pre-wrap; margin: var(--spacing-1) 0;">{{ msg.content }}</p>
-            {% if msg.media_blob_path %}
-              <div class="nexus-media-preview">
-                {% set ext = msg.media_blob_path.split('.')[-1].lower() %}
-                {% if ext in ['png','jpg','jpeg','gif'] %}
-                  <img src="{{ msg.media_blob_path }}">
-                {% elif ext in ['mp4','webm'] %}
-                  <video controls style="max-width:100%;"><source src="{{ msg.media_blob_path }}"></video>
-                {% else %}
-                  <a href="{{ msg.media_blob_path }}" target="_blank">Download</a>
-                {% endif %}
-              </div>
-            {% endif %}
-            <span class="nexus-timestamp">{{ msg.timestamp.strftime('%H:%M') }}</span>
-          </div>
-        </div>
-      {% endfor %}
-    </main>
-
-    <form class="nexus-input-bar" action="{{ url_for('group_chat', group_id=group.id) }}" method="post" enctype="multipart/form-data">
-      <input type="text" name="message" class="nexus-input" placeholder="Message #{{ group.name }}" required autocomplete="off">
-      <label class="nexus-button ghost">
-        Attach <input type="file" name="media" class="nexus-file-input">
-      </label>
-      <button type="submit" class="nexus-button primary">Send</button>
-    </form>
-  </div>
-  {% endif %}
-
-  <script>
-    document.addEventListener('DOMContentLoaded', () => {
-      ['messages', 'group-messages'].forEach(id => {
-        const el = document.getElementById(id);
-        if (el) el.scrollTop = el.scrollHeight;
-      });
-
-      document.querySelectorAll('.nexus-button').forEach(btn => {
-        btn.addEventListener('click', e => {
-          const ripple = document.createElement('span');
-          ripple.classList.add('ripple');
-          const rect = btn.getBoundingClientRect();
-          ripple.style.left = `${e.clientX - rect.left}px`;
-          ripple.style.top = `${e.clientY - rect.top}px`;
-          btn.appendChild(ripple);
-          setTimeout(() => ripple.remove(), 600);
-        });
-      });
-    });
-
-    async function pasteFromClipboard() {
-      try {
-        const text = await navigator.clipboard.readText();
-        const textarea = document.querySelector('.nexus-textarea');
-        if (textarea) {
-          const start = textarea.selectionStart;
-          const end = textarea.selectionEnd;
-          textarea.value = textarea.value.substring(0, start) + text + textarea.value.substring(end);
-          textarea.selectionStart = textarea.selectionEnd = start + text.length;
-          textarea.focus();
-        }
-      } catch (err) { console.error('Paste failed:', err); }
-    }
-  </script>
-</body>
-</html>'''
+def notify_new_message(msg):
+    # Call after commit so every woken subscriber can already read the row
+    history_cache.invalidate(message_channel(msg))  # Other workers see the new last_message_id instead
+    bus.publish(message_channel(msg), msg.id)
 
-# --- Routes ---
-from sqlalchemy.orm import joinedload
+def notify_message_updated(msg):
+    history_cache.invalidate(message_channel(msg))
+    bus.publish(message_channel(msg), {'updated': msg.id})
 
 @app.route('/')
 @login_required
 def home():
-    user_groups = Group.query.join(GroupMember).filter(GroupMember.user_id == current_user.id).all()
-    all_users = User.query.all()
-    received_messages = (
-        Message.query
-        .filter_by(receiver_id=current_user.id)
-        .options(joinedload(Message.sender))
-        .order_by(Message.timestamp.desc())
-        .all()
-    )
-    return render_template_string(
-        NEXUS_HTML,
-        page='home',
+    user_groups = user_groups_cached(current_user.id)
+    query = request.args.get('q', '').strip()
+    # Flashes show once, and user search results change as people register: neither gets a validator
+    etag = last_modified = None
+    if not query and not session.get('_flashes'):
+        last_message_id, unread, last_modified = inbox_version(current_user.id)
+        etag = page_etag(last_message_id, unread, sorted(user_groups), current_user.username)
+        cached = not_modified(etag, last_modified)
+        if cached:
+            return cached
+    user_groups = list(user_groups.values())
+    contacts = recent_contacts(current_user.id, app.config['RECENT_CONTACTS'])
+    matches, next_cursor = [], None
+    if query:  # Without JS the search box submits here; with JS it queries /users/search instead
+        matches, next_cursor = search_users(query, limit=app.config['USER_SEARCH_LIMIT'], exclude_id=current_user.id)
+    conversations = inbox_conversations(current_user.id, app.config['INBOX_SIZE'])
+    response = app.make_response(render_template(
+        'home.html',
         page_title='Home',
         user_groups=user_groups,
-        all_users=all_users,
-        received_messages=received_messages
+        contacts=contacts,
+        query=query,
+        matches=matches,
+        next_cursor=next_cursor,
+        conversations=conversations
+    ))
+    return with_validators(response, etag, last_modified) if etag else response
+
+@app.route('/users/search')
+@login_required
+def user_search():
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'users': [], 'next': None})
+    limit = request.args.get('limit', app.config['USER_SEARCH_LIMIT'], type=int)
+    rows, next_cursor = search_users(
+        query,
+        after=request.args.get('after', type=int),
+        limit=max(1, min(limit, app.config['USER_SEARCH_LIMIT'])),
+        exclude_id=current_user.id
     )
+    return jsonify({
+        'users': [{'id': row.id, 'username': row.username, 'url': url_for('private_chat', receiver_id=row.id)} for row in rows],
+        'next': next_cursor,
+    })
 
 @app.route('/private/<int:receiver_id>')
 @login_required
 def private_chat(receiver_id):
     receiver = User.query.get_or_404(receiver_id)
-    messages = (
-        Message.query
-        .filter(
-            ((Message.sender_id == current_user.id) & (Message.receiver_id == receiver.id)) |
-            ((Message.sender_id == receiver.id) & (Message.receiver_id == current_user.id))
-        )
-        .options(joinedload(Message.sender))
-        .order_by(Message.timestamp.asc())
-        .all()
+    before = request.args.get('before', type=int)
+    if before is None:
+        mark_read(current_user.id, 'private', receiver.id)
+    last_message_id, last_modified = conversation_version(current_user.id, 'private', receiver.id)
+    pending = pending_media_version(current_user.id, 'private', receiver.id)
+    etag = page_etag(last_message_id, pending, receiver.username)
+    cached = not_modified(etag, last_modified)
+    if cached:
+        return cached
+    messages, older_cursor, newest_id = recent_messages(
+        private_history_query(current_user.id, receiver.id),
+        private_channel(current_user.id, receiver.id),
+        (last_message_id, pending),
+        before=before
     )
-    return render_template_string(
-        NEXUS_HTML,
-        page='private_chat',
+    return with_validators(stream_page(
+        'private_chat.html',
         receiver=receiver,
         messages=messages,
+        older_cursor=older_cursor,
+        newest_id=newest_id,
         page_title='Chat'
-    )
+    ), etag, last_modified)
 
 @app.route('/register', methods=['GET', 'POST'])
 def register():
@@ -617,7 +1003,7 @@ def register():
         db.session.commit()
         flash('Registered! Please log in.', 'success')
         return redirect(url_for('login'))
-    return render_template_string(NEXUS_HTML, page='register', page_title='Register')
+    return render_template('register.html', page_title='Register')
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -629,7 +1015,7 @@ def login():
             login_user(user)
             return redirect(url_for('home'))
         flash('Invalid credentials', 'error')
-    return render_template_string(NEXUS_HTML, page='login', page_title='Login')
+    return render_template('login.html', page_title='Login')
 
 @app.route('/logout')
 @login_required
@@ -638,75 +1024,445 @@ def logout():
     return redirect(url_for('login'))
 
 # --- BLOB UPLOAD (Vercel SDK + HTTP Fallback) ---
-def upload_blob(file_data, filename):
+_blob_session = None
+_blob_session_pid = None
+
+def get_blob_session():
+    # One keep-alive pool per worker process (created after fork), retrying idempotent PUTs
+    global _blob_session, _blob_session_pid
+    if _blob_session is None or _blob_session_pid != os.getpid():
+        import requests  # Fallback for blob upload on PythonAnywhere
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+        retry = Retry(
+            total=app.config['BLOB_RETRIES'],
+            backoff_factor=0.5,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(['PUT']),
+        )
+        adapter = HTTPAdapter(pool_maxsize=app.config['BLOB_POOL_SIZE'], max_retries=retry)
+        _blob_session = requests.Session()
+        _blob_session.mount('https://', adapter)
+        _blob_session.mount('http://', adapter)
+        _blob_session_pid = os.getpid()
+    return _blob_session
+
+_vercel_put = False  # Not looked up yet; None once we know the SDK isn't installed
+
+def get_vercel_put():
+    global _vercel_put
+    if _vercel_put is False:
+        try:
+            from vercel.blob import put  # Try Vercel SDK
+        except ImportError:
+            put = None  # Fallback to HTTP if not available
+        _vercel_put = put
+    return _vercel_put
+
+class ChunkedUpload:
+    # Request body that reads the source in BLOB_CHUNK_SIZE pieces; tell/seek let urllib3 rewind on retry
+    def __init__(self, stream, chunk_size):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.start = stream.tell()
+        self.length = stream.seek(0, os.SEEK_END) - self.start
+        stream.seek(self.start)
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        while True:
+            chunk = self.stream.read(self.chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+    def tell(self):
+        return self.stream.tell()
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self.stream.seek(offset, whence)
+
+def save_local_blob(stream, pathname):
+    # Write to a temp file beside the target, then rename: readers never see a partial file
+    target = safe_join(app.config['UPLOAD_FOLDER'], pathname)
+    if target is None:
+        raise ValueError(f"Unsafe blob path: {pathname}")
+    if not os.path.exists(target):  # Content-addressed: an existing file already holds these bytes
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(target), prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                shutil.copyfileobj(stream, out, app.config['BLOB_CHUNK_SIZE'])
+                out.flush()
+                os.fsync(out.fileno())
+            os.replace(tmp, target)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+    return f"/uploads/{pathname}"
+
+@timed_stage('blob')
+def upload_blob(stream, pathname):
+    if app.config['BLOB_BACKEND'] == 'local':
+        return save_local_blob(stream, pathname)
+
     token = os.getenv('BLOB_READ_WRITE_TOKEN')
     if not token:
         raise Exception("BLOB_READ_WRITE_TOKEN missing")
 
-    pathname = f"chat-media/{current_user.id}/{filename}"
-    url = f"https://blob.vercel-storage.com/{pathname}"
+    url = f"{app.config['BLOB_API_URL']}/{pathname}"
+    start = stream.tell()
 
+    put = get_vercel_put()
     if put:  # Try Vercel SDK
         try:
-            blob = put(pathname=pathname, data=file_data, access="public", token=token)
+            blob = put(pathname=pathname, data=stream, access="public", token=token)
             return blob.url
         except:
-            pass  # Fall back to HTTP
+            stream.seek(start)  # Fall back to HTTP
 
-    # HTTP Fallback
+    # HTTP Fallback (streamed from the spooled upload; never fully buffered)
     headers = {"Authorization": f"Bearer {token}", "Access": "public"}
-    response = requests.put(url, data=file_data, headers=headers)
+    body = ChunkedUpload(stream, app.config['BLOB_CHUNK_SIZE'])
+    response = get_blob_session().put(url, data=body, headers=headers, timeout=(5, 60))
     response.raise_for_status()
     return response.json().get('url', url)
 
+# --- Content-Addressed Media (identical payloads are uploaded once) ---
+def hash_stream(stream, out=None):
+    # sha256 + size in BLOB_CHUNK_SIZE reads, optionally teeing to `out`; leaves the stream where it started
+    start = stream.tell()
+    digest = hashlib.sha256()
+    size = 0
+    while True:
+        chunk = stream.read(app.config['BLOB_CHUNK_SIZE'])
+        if not chunk:
+            break
+        digest.update(chunk)
+        size += len(chunk)
+        if out:
+            out.write(chunk)
+    stream.seek(start)
+    return digest.hexdigest(), size
+
+def media_pathname(digest, filename):
+    # Two-level shard keeps local directories small; the extension is kept since templates pick <img>/<video>/<audio> from it
+    return f"chat-media/{digest[:2]}/{digest[2:4]}/{digest}{os.path.splitext(filename)[1].lower()}"
+
+def store_media(stream, digest, size, filename, preview=None):
+    # preview: MediaObject preview columns (see build_preview) to insert along with the row
+    with db.session.no_autoflush:  # A pending message isn't written (and the write lock taken) until after the upload
+        obj = db.session.get(MediaObject, digest)
+    if obj:
+        return obj.url
+    url = upload_blob(stream, media_pathname(digest, filename))
+    # A concurrent upload of the same bytes may have won; its row points at the same content
+    db.session.execute(
+        sqlite_insert(MediaObject).values(digest=digest, url=url, size=size, **(preview or {})).on_conflict_do_nothing()
+    )
+    return url
+
+# --- Background Media Uploads ---
+# Jobs are staged on disk as UPLOAD_QUEUE_DIR/<message_id>.<pid>/<filename>; the pid marks the owning worker.
+# Uploads are copied in under .staging-<pid>-* first and renamed once the message has an id.
+def stage_media(msg, media):
+    # Attach media to a new (added, uncommitted) message; returns a job to submit after commit, if any
+    filename = secure_filename(media.filename)
+    if app.config['UPLOAD_MODE'] == 'inline':
+        msg.media_blob_path, msg.media_digest = store_media_inline(media.stream, filename)
+        msg.media_status = 'ready'
+        return None
+    # Copy and hash before the flush: it opens the write transaction, which would otherwise stay locked for the whole copy
+    staging = tempfile.mkdtemp(dir=app.config['UPLOAD_QUEUE_DIR'], prefix=f'.staging-{os.getpid()}-')
+    try:
+        with open(os.path.join(staging, filename), 'wb') as out:
+            digest, size = hash_stream(media.stream, out)
+        with db.session.no_autoflush:
+            known = db.session.get(MediaObject, digest)
+        if known:
+            # Already stored: reference it and skip the queue entirely
+            shutil.rmtree(staging, ignore_errors=True)
+            msg.media_blob_path = known.url
+            msg.media_digest = digest
+            msg.media_status = 'ready'
+            return None
+        msg.media_status = 'pending'
+        db.session.flush()
+        job_dir = os.path.join(app.config['UPLOAD_QUEUE_DIR'], f'{msg.id}.{os.getpid()}')
+        os.rename(staging, job_dir)
+    except Exception:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    return {'message_id': msg.id, 'path': os.path.join(job_dir, filename), 'digest': digest, 'size': size}
+
+def store_media_inline(stream, filename):
+    # Nothing runs after the response on serverless, so the preview is made in this request too (in-process:
+    # no pool to spawn). Returns (url, digest).
+    staging = tempfile.mkdtemp(dir=app.config['UPLOAD_QUEUE_DIR'], prefix=f'.staging-{os.getpid()}-')
+    try:
+        path = os.path.join(staging, filename)
+        with open(path, 'wb') as out:
+            digest, size = hash_stream(stream, out)
+        with db.session.no_autoflush:
+            known = db.session.get(MediaObject, digest)
+        if known:
+            return known.url, digest
+        try:
+            preview = build_preview(digest, path, inline=True)
+        except Exception as e:
+            preview = None
+            app.logger.warning('Preview for %s failed: %s', digest, e)  # Original still works
+        with open(path, 'rb') as source:
+            return store_media(source, digest, size, filename, preview), digest
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+def _finish_upload_job(job, url, status):
+    with app.app_context():
+        msg = db.session.get(Message, job['message_id'])
+        if msg:
+            msg.media_blob_path = url
+            msg.media_digest = job['digest'] if url else None
+            msg.media_status = status
+            db.session.commit()
+            notify_message_updated(msg)
+    shutil.rmtree(os.path.dirname(job['path']), ignore_errors=True)
+
+def process_upload_job(job):
+    with app.app_context(), open(job['path'], 'rb') as stream:
+        url = store_media(stream, job['digest'], job['size'], os.path.basename(job['path']))
+        db.session.commit()
+        try:
+            generate_preview(job['digest'], job['path'])
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            app.logger.warning('Preview for %s failed: %s', job['digest'], e)  # Original still works; don't retry the upload
+    _finish_upload_job(job, url, 'ready')
+
+# --- Media Previews (thumbnails / video poster frames, built in a process pool; in-process with UPLOAD_MODE=inline) ---
+_thumbnail_pool = None
+_thumbnail_pool_pid = None
+
+def get_thumbnail_pool():
+    global _thumbnail_pool, _thumbnail_pool_pid
+    if _thumbnail_pool is None or _thumbnail_pool_pid != os.getpid():
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        # spawn: pool children must not inherit this process's threads, sockets or DB connections
+        _thumbnail_pool = ProcessPoolExecutor(app.config['THUMBNAIL_WORKERS'], mp_context=multiprocessing.get_context('spawn'))
+        _thumbnail_pool_pid = os.getpid()
+    return _thumbnail_pool
+
+def build_preview(digest, source_path, inline=False):
+    # Makes and uploads the preview of a local original; returns its MediaObject columns, or None if there isn't one
+    if not thumbnails.can_preview(source_path):
+        return None
+    dest = f'{source_path}.preview.jpg'
+    args = (source_path, dest, app.config['THUMBNAIL_SIZE'])
+    info = thumbnails.make_preview(*args) if inline else get_thumbnail_pool().submit(thumbnails.make_preview, *args).result(timeout=120)
+    if not info:
+        return None
+    with open(dest, 'rb') as preview:
+        return {'preview_url': upload_blob(preview, f"chat-media/{digest[:2]}/{digest[2:4]}/{digest}.preview.jpg"), **info}
+
+def generate_preview(digest, source_path):
+    # Runs in an upload worker thread while the staged original is still on local disk
+    obj = db.session.get(MediaObject, digest)
+    if obj is None or obj.preview_url:
+        return
+    for key, value in (build_preview(digest, source_path) or {}).items():
+        setattr(obj, key, value)
+
+def fail_upload_job(job, exc):
+    app.logger.error('Media upload for message %s failed: %s', job['message_id'], exc)
+    _finish_upload_job(job, None, 'failed')
+
+def recover_upload_jobs():
+    # Re-queue jobs staged by workers that died before finishing; the rename claims each one atomically
+    for name in os.listdir(app.config['UPLOAD_QUEUE_DIR']):
+        if name.startswith('.staging-'):
+            # Copy cut short by the worker's death, before its message was flushed
+            pid = name.split('-')[1]
+            if pid.isdigit() and int(pid) != os.getpid() and not _pid_alive(int(pid)):
+                shutil.rmtree(os.path.join(app.config['UPLOAD_QUEUE_DIR'], name), ignore_errors=True)
+            continue
+        message_id, _, pid = name.partition('.')
+        if not (message_id.isdigit() and pid.isdigit()) or int(pid) == os.getpid() or _pid_alive(int(pid)):
+            continue
+        with app.app_context():
+            msg = db.session.get(Message, int(message_id))
+            orphaned = msg is None or msg.media_status != 'pending'
+        if orphaned:
+            # Staged by a worker that died before its commit; the id may already belong to another message
+            shutil.rmtree(os.path.join(app.config['UPLOAD_QUEUE_DIR'], name), ignore_errors=True)
+            continue
+        job_dir = os.path.join(app.config['UPLOAD_QUEUE_DIR'], f'{message_id}.{os.getpid()}')
+        try:
+            os.rename(os.path.join(app.config['UPLOAD_QUEUE_DIR'], name), job_dir)
+            path = os.path.join(job_dir, os.listdir(job_dir)[0])
+            with open(path, 'rb') as stream:
+                digest, size = hash_stream(stream)
+        except (OSError, IndexError):
+            continue
+        upload_queue.submit({'message_id': int(message_id), 'path': path, 'digest': digest, 'size': size})
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+upload_queue = UploadQueue(
+    process_upload_job,
+    on_failure=fail_upload_job,
+    on_start=recover_upload_jobs,
+    workers=app.config['UPLOAD_WORKERS'],
+    max_attempts=app.config['UPLOAD_MAX_ATTEMPTS'],
+)
+
+# --- Message Ingest (one path for every new message; text-only ones can be group-committed) ---
+def _insert_messages(rows):
+    msgs = [Message(**row) for row in rows]
+    db.session.add_all(msgs)
+    db.session.flush()
+    published = [(message_channel(msg), msg.id) for msg in msgs]  # Read before commit expires them
+    db.session.commit()
+    for channel, msg_id in published:
+        history_cache.invalidate(channel)
+        bus.publish(channel, msg_id)
+    return [msg_id for _, msg_id in published]
+
+def insert_message_batch(rows):
+    # One transaction (one fsync) for the batch; if it fails, retry row by row so one bad row can't sink the rest
+    with app.app_context():
+        try:
+            return _insert_messages(rows)
+        except Exception as exc:
+            db.session.rollback()
+            if len(rows) == 1:
+                return [exc]
+        results = []
+        for row in rows:
+            try:
+                results.extend(_insert_messages([row]))
+            except Exception as exc:
+                db.session.rollback()
+                results.append(exc)
+        return results
+
+write_batcher = WriteBatcher(
+    insert_message_batch,
+    max_batch=app.config['WRITE_BATCH_MAX'],
+    max_delay=app.config['WRITE_BATCH_DELAY'],
+)
+
+def validate_message(kind, peer_id, content, has_media):
+    # Shared by send_message and the JSON API: returns create_message's target kwargs,
+    # or aborts with a description fit to show the user
+    if not content and not has_media:
+        abort(400, 'Cannot send empty message.')
+    if kind == 'private':
+        if not str(peer_id).isdigit() or load_user(peer_id) is None:
+            abort(404, 'Receiver missing.')
+        return {'receiver_id': int(peer_id)}
+    if kind == 'group':
+        if not peer_id:
+            abort(404, 'Group missing.')
+        if not str(peer_id).isdigit() or not is_member(peer_id, current_user.id):
+            abort(403, 'Not a member of that group.')
+        return {'group_id': int(peer_id)}
+    abort(404, 'Invalid chat type.')
+
+def create_message(sender_id, content, media=None, receiver_id=None, group_id=None):
+    # Returns the new message id once committed; raises if it (or its media) couldn't be stored
+    if app.config['WRITE_BATCHING'] and not media:
+        row = {'sender_id': sender_id, 'receiver_id': receiver_id, 'group_id': group_id, 'content': content}
+        return write_batcher.submit(row).result(timeout=app.config['WRITE_BATCH_TIMEOUT'])
+    msg = Message(sender_id=sender_id, receiver_id=receiver_id, group_id=group_id, content=content)
+    db.session.add(msg)
+    job = None
+    if media:
+        try:
+            job = stage_media(msg, media)
+        except Exception:
+            db.session.rollback()
+            raise
+    try:
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        if job:
+            shutil.rmtree(os.path.dirname(job['path']), ignore_errors=True)  # The message id will be reused
+        raise
+    if job:
+        upload_queue.submit(job)
+    notify_new_message(msg)
+    return msg.id
+
+@app.route('/metrics/uploads')
+def upload_metrics():
+    return jsonify(upload_queue.stats())
+
+@app.route('/metrics/writes')
+def write_metrics():
+    return jsonify({'batching': app.config['WRITE_BATCHING'], **write_batcher.stats()})
+
+@app.route('/metrics/caches')
+def cache_metrics():
+    return jsonify({'users': user_cache.stats(), 'membership': membership_cache.stats(), 'history': history_cache.stats()})
+
+@registry.collector
+def component_metrics():
+    # The stats behind /metrics/uploads, /metrics/writes and /metrics/caches, read at scrape time
+    uploads = upload_queue.stats()
+    writes = write_batcher.stats()
+    caches = {'users': user_cache.stats(), 'membership': membership_cache.stats(), 'history': history_cache.stats()}
+    return [
+        ('chat4c_upload_queue_depth', 'gauge', 'Upload jobs waiting, including scheduled retries.', [({}, uploads['depth'])]),
+        ('chat4c_upload_queue_in_flight', 'gauge', 'Upload jobs being processed.', [({}, uploads['in_flight'])]),
+        ('chat4c_upload_jobs_total', 'counter', 'Upload jobs by outcome.',
+         [({'outcome': key}, uploads[key]) for key in ('submitted', 'completed', 'retried', 'failed')]),
+        ('chat4c_write_batches_total', 'counter', 'Group-commit transactions.', [({}, writes['batches'])]),
+        ('chat4c_write_batch_items_total', 'counter', 'Messages written through group commit.', [({}, writes['items'])]),
+        ('chat4c_write_batch_latency_seconds', 'gauge', 'Recent submit-to-commit latency of group-committed messages.',
+         [({'quantile': q}, writes[f'latency_ms_p{q[2:]}'] / 1000) for q in ('0.50', '0.95')]),
+        ('chat4c_cache_entries', 'gauge', 'Entries per cache.', [({'cache': name}, s['size']) for name, s in caches.items()]),
+        ('chat4c_cache_hits_total', 'counter', 'Cache hits.', [({'cache': name}, s['hits']) for name, s in caches.items()]),
+        ('chat4c_cache_misses_total', 'counter', 'Cache misses.', [({'cache': name}, s['misses']) for name, s in caches.items()]),
+        ('chat4c_cache_evictions_total', 'counter', 'Cache evictions.', [({'cache': name}, s['evictions']) for name, s in caches.items()]),
+        ('chat4c_cache_bytes', 'gauge', 'Approximate memory held by size-capped caches.',
+         [({'cache': name}, s['weight']) for name, s in caches.items() if 'weight' in s]),
+    ]
+
+@app.route('/metrics')
+def prometheus_metrics():
+    # Request/SQL families only fill up with METRICS_ENABLED=1; component stats are always there
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/send_message', methods=['POST'])
 @login_required
 def send_message():
     content = request.form.get('content', '').strip()
     chat_type = request.form.get('chat_type')
     media = request.files.get('media')
-    media_url = None
-
-    if not content and not media:
-        flash('Cannot send empty message.', 'error')
-        return redirect(request.referrer or url_for('home'))
-
-    if media and media.filename:
-        filename = secure_filename(media.filename)
-        try:
-            media_url = upload_blob(media.read(), filename)
-        except Exception as e:
-            flash('Media upload failed.', 'error')
-            return redirect(request.referrer or url_for('home'))
-
-    if chat_type == 'private':
-        receiver_id = request.form.get('receiver_id')
-        if not receiver_id:
-            flash('Receiver missing.', 'error')
-            return redirect(url_for('home'))
-        msg = Message(
-            sender_id=current_user.id,
-            receiver_id=receiver_id,
-            content=content or '',
-            media_blob_path=media_url
-        )
-    elif chat_type == 'group':
-        group_id = request.form.get('group_id')
-        if not group_id:
-            flash('Group missing.', 'error')
-            return redirect(url_for('home'))
-        msg = Message(
-            sender_id=current_user.id,
-            group_id=group_id,
-            content=content or '',
-            media_blob_path=media_url
-        )
-    else:
-        flash('Invalid chat type.', 'error')
-        return redirect(url_for('home'))
-
-    db.session.add(msg)
-    db.session.commit()
+    has_media = bool(media and media.filename)
+    try:
+        target = validate_message(chat_type, request.form.get('group_id' if chat_type == 'group' else 'receiver_id'), content, has_media)
+    except HTTPException as e:
+        flash(e.description, 'error')
+        # An empty send goes back to the chat; a bad target goes home
+        return redirect(request.referrer or url_for('home') if e.code == 400 else url_for('home'))
+    try:
+        create_message(current_user.id, content or '', media if has_media else None, **target)
+    except Exception as e:
+        app.logger.warning('send_message failed: %s', e)
+        flash('Media upload failed.' if has_media else 'Message could not be sent.', 'error')
     return redirect(request.referrer or url_for('home'))
 
 @app.route('/create_group', methods=['POST'])
@@ -721,6 +1477,7 @@ def create_group():
         db.session.flush()
         db.session.add(GroupMember(group_id=group.id, user_id=current_user.id))
         db.session.commit()
+        membership_changed(group.id, current_user.id)
         flash('Group created!', 'success')
     return redirect(url_for('home'))
 
@@ -729,73 +1486,413 @@ def create_group():
 def join_group():
     name = request.form.get('group_name')
     group = Group.query.filter_by(name=name).first()
-    if group and not GroupMember.query.filter_by(group_id=group.id, user_id=current_user.id).first():
+    if group and not is_member(group.id, current_user.id):
         db.session.add(GroupMember(group_id=group.id, user_id=current_user.id))
         db.session.commit()
+        membership_changed(group.id, current_user.id)
         flash('Joined group!', 'success')
     return redirect(url_for('home'))
 
 @app.route('/groups')
 @login_required
 def groups():
-    user_groups = Group.query.join(GroupMember).filter(GroupMember.user_id == current_user.id).all()
-    return render_template_string(
-        NEXUS_HTML,
-        page='groups',
+    user_groups = list(user_groups_cached(current_user.id).values())
+    return render_template(
+        'groups.html',
         page_title='Groups',
-        groups=user_groups
+        groups=user_groups,
+        member_counts={group.id: len(group_members_cached(group.id)) for group in user_groups}
     )
 
 @app.route('/group/<int:group_id>', methods=['GET', 'POST'])
 @login_required
 def group_chat(group_id):
-    group = Group.query.get_or_404(group_id)
-    if not GroupMember.query.filter_by(group_id=group_id, user_id=current_user.id).first():
+    group = user_groups_cached(current_user.id).get(group_id)
+    if group is None:
+        Group.query.get_or_404(group_id)
         return redirect(url_for('groups'))
 
     if request.method == 'POST':
         content = request.form.get('message')
         media = request.files.get('media')
-        media_url = None
-        if media and media.filename:
-            filename = secure_filename(media.filename)
+        has_media = bool(media and media.filename)
+        if content or has_media:
             try:
-                media_url = upload_blob(media.read(), filename)
+                create_message(current_user.id, content, media if has_media else None, group_id=group_id)
             except Exception as e:
-                flash('Media upload failed.', 'error')
-                return redirect(url_for('group_chat', group_id=group_id))
-        if content or media_url:
-            msg = Message(
-                sender_id=current_user.id,
-                group_id=group_id,
-                content=content,
-                media_blob_path=media_url
-            )
-            db.session.add(msg)
-            db.session.commit()
+                app.logger.warning('group_chat post failed: %s', e)
+                flash('Media upload failed.' if has_media else 'Message could not be sent.', 'error')
         return redirect(url_for('group_chat', group_id=group_id))
 
-    messages = (
-        Message.query
-        .filter_by(group_id=group_id)
-        .options(joinedload(Message.sender))
-        .order_by(Message.timestamp.asc())
-        .all()
+    before = request.args.get('before', type=int)
+    if before is None:
+        mark_read(current_user.id, 'group', group_id)
+    last_message_id, last_modified = conversation_version(current_user.id, 'group', group_id)
+    pending = pending_media_version(current_user.id, 'group', group_id)
+    etag = page_etag(last_message_id, pending, group.name)
+    cached = not_modified(etag, last_modified)
+    if cached:
+        return cached
+    messages, older_cursor, newest_id = recent_messages(
+        group_history_query(group_id),
+        group_channel(group_id),
+        (last_message_id, pending),
+        before=before
     )
-    return render_template_string(
-        NEXUS_HTML,
-        page='group_chat',
+    return with_validators(stream_page(
+        'group_chat.html',
         group=group,
         messages=messages,
+        older_cursor=older_cursor,
+        newest_id=newest_id,
         page_title=group.name
+    ), etag, last_modified)
+
+# --- Message Search (FTS5, limited to the caller's own conversations and groups) ---
+SNIPPET_START, SNIPPET_END = '\x02', '\x03'  # Marker bytes swapped for <mark> after HTML-escaping
+message_fts = db.table('message_fts', db.column('rowid'), db.column('rank'))
+
+def fts_query(text):
+    # Quote every word so user input can't form FTS5 syntax; the last word also matches as a prefix
+    terms = re.findall(r'\w+', text)
+    if not terms:
+        return None
+    return ' '.join(f'"{term}"' for term in terms) + '*'
+
+def highlight(snippet):
+    return Markup(str(escape(snippet)).replace(SNIPPET_START, '<mark>').replace(SNIPPET_END, '</mark>'))
+
+def search_messages(user_id, text, page=1, limit=20):
+    # Returns ([(message, snippet_html)], has_more), best match (bm25 rank) first
+    match = fts_query(text)
+    if match is None:
+        return [], False
+    scope = or_(
+        Message.receiver_id == user_id,
+        (Message.sender_id == user_id) & Message.receiver_id.isnot(None),
+        Message.group_id.in_(list(user_groups_cached(user_id))),
+    )
+    snippet = db.func.snippet(db.literal_column('message_fts'), 0, SNIPPET_START, SNIPPET_END, '…', 16)
+    rows = (
+        db.session.query(Message, snippet)
+        .join(message_fts, message_fts.c.rowid == Message.id)
+        .filter(db.literal_column('message_fts').match(match), scope)
+        .options(joinedload(Message.sender), joinedload(Message.receiver), joinedload(Message.group))
+        .order_by(message_fts.c.rank, Message.id.desc())
+        .offset((page - 1) * limit)
+        .limit(limit + 1)
+        .all()
+    )
+    return [(msg, highlight(text)) for msg, text in rows[:limit]], len(rows) > limit
+
+def search_result(msg, snippet, viewer_id):
+    if msg.group_id:
+        kind, peer_id, title = 'group', msg.group_id, f'#{msg.group.name}'
+    else:
+        other = msg.receiver if msg.sender_id == viewer_id else msg.sender
+        kind, peer_id, title = 'private', other.id, other.username
+    return {
+        'id': msg.id,
+        'kind': kind,
+        'title': title,
+        'url': url_for('group_chat', group_id=peer_id) if kind == 'group' else url_for('private_chat', receiver_id=peer_id),
+        'sender': msg.sender.username,
+        'snippet': snippet,
+        'time': msg.timestamp.strftime('%Y-%m-%d %H:%M'),
+    }
+
+@app.route('/search')
+@login_required
+def search():
+    query = request.args.get('q', '').strip()
+    page = max(1, min(request.args.get('page', 1, type=int), app.config['SEARCH_MAX_PAGES']))
+    wants_json = request.accept_mimetypes.best_match(['text/html', 'application/json']) == 'application/json'
+    if not SEARCH_ENABLED:
+        if wants_json:
+            return jsonify({'error': 'Search is unavailable.'}), 503
+        flash('Search is unavailable on this server.', 'error')
+        return redirect(url_for('home'))
+    rows, has_more = search_messages(current_user.id, query, page, app.config['SEARCH_PAGE_SIZE'])
+    results = [search_result(msg, snippet, current_user.id) for msg, snippet in rows]
+    next_page = page + 1 if has_more and page < app.config['SEARCH_MAX_PAGES'] else None
+    if wants_json:
+        return jsonify({'query': query, 'page': page, 'next_page': next_page, 'results': results})
+    return render_template(
+        'search.html',
+        page_title='Search',
+        query=query,
+        page=page,
+        next_page=next_page,
+        results=results
+    )
+
+# --- Live Updates (Server-Sent Events) ---
+def message_payload(msg, viewer_id):
+    return {
+        'id': msg.id,
+        'sender': msg.sender.username,
+        'outgoing': msg.sender_id == viewer_id,
+        'content': msg.content or '',
+        'media': msg.media_blob_path,
+        'media_status': msg.media_status,
+        'preview': msg.media.preview_url if msg.media else None,
+        'preview_size': [msg.media.preview_width, msg.media.preview_height] if msg.media and msg.media.preview_url else None,
+        'time': msg.timestamp.strftime('%H:%M'),
+    }
+
+def messages_after(history_query, after, last_message_id, limit):
+    # Messages newer than the cursor, oldest first. `id > after` can only range-scan the rowid (every newer
+    # message in the table), so the conversation's summary row (a primary-key lookup) is checked first and
+    # bounds the range: a quiet conversation runs no history query at all.
+    if last_message_id <= after:
+        return []
+    return (
+        history_query
+        .filter(Message.id > after, Message.id <= last_message_id)
+        .options(joinedload(Message.sender), joinedload(Message.media))
+        .order_by(Message.id.asc())
+        .limit(limit)
+        .all()
+    )
+
+def message_stream(history_query, channel, viewer_id, conversation):
+    # conversation = (kind, peer_id) of the viewer's inbox row, cleared as messages are delivered
+    # Resume from the browser's Last-Event-ID on reconnect, else from the page's newest message
+    last_id = request.headers.get('Last-Event-ID', type=int) or request.args.get('after', 0, type=int)
+    # Ids the page still shows as uploading: their update may have been published while no stream was open
+    recheck = {int(i) for i in request.args.get('pending', '').split(',')[:app.config['CHAT_PAGE_SIZE']] if i.isdigit()}
+    hold = app.config['SSE_HOLD'] == '1' or (app.config['SSE_HOLD'] == 'auto' and request.environ.get('wsgi.multithread'))
+    deadline = time.monotonic() + (app.config['SSE_MAX_DURATION'] if hold else 0)
+
+    def generate():
+        nonlocal last_id, recheck
+        yield f"retry: {1000 if hold else app.config['SSE_POLL_RETRY_MS']}\n\n"
+        # Subscribe before the first read so nothing committed in between is missed
+        with bus.subscribe(channel) as sub:
+            while True:
+                last_message_id = conversation_version(viewer_id, *conversation)[0]
+                fresh = messages_after(history_query, last_id, last_message_id, app.config['CHAT_PAGE_SIZE'])
+                for msg in fresh:
+                    last_id = msg.id
+                    yield f"id: {msg.id}\ndata: {json.dumps(message_payload(msg, viewer_id))}\n\n"
+                if fresh:
+                    mark_read(viewer_id, *conversation)
+                # Already-sent messages that changed since (e.g. a background upload finished)
+                updated = {p['updated'] for p in sub.drain() if isinstance(p, dict) and p.get('updated', 0) <= last_id}
+                if updated or recheck:
+                    changed = (
+                        history_query
+                        .filter(Message.id.in_(updated | recheck))
+                        .options(joinedload(Message.sender), joinedload(Message.media))
+                    )
+                    for msg in changed:
+                        if msg.id in updated or msg.media_status != 'pending':
+                            yield f"event: update\ndata: {json.dumps(message_payload(msg, viewer_id))}\n\n"
+                    recheck = set()  # Later changes arrive through the bus
+                db.session.close()  # Don't pin a connection/snapshot while idle
+                if len(fresh) == app.config['CHAT_PAGE_SIZE']:
+                    continue
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                # Sleep until a worker publishes on this channel; re-check anyway on timeout
+                if not sub.wait(min(app.config['SSE_POLL_INTERVAL'], remaining)):
+                    yield ": keepalive\n\n"
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
     )
 
+@app.route('/stream/private/<int:receiver_id>')
+@login_required
+def stream_private(receiver_id):
+    receiver = User.query.get_or_404(receiver_id)
+    return message_stream(
+        private_history_query(current_user.id, receiver.id),
+        private_channel(current_user.id, receiver.id),
+        current_user.id,
+        ('private', receiver.id)
+    )
+
+@app.route('/stream/group/<int:group_id>')
+@login_required
+def stream_group(group_id):
+    if not is_member(group_id, current_user.id):
+        Group.query.get_or_404(group_id)
+        abort(403)
+    return message_stream(group_history_query(group_id), group_channel(group_id), current_user.id, ('group', group_id))
+
+# --- JSON API (same payloads as the live stream; cursors are message ids) ---
+def api_login_required(view):
+    # login_required answers with a redirect to the login page; API clients get a 401 instead
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not current_user.is_authenticated:
+            abort(401, 'Login required.')
+        return view(*args, **kwargs)
+    return wrapper
+
+@app.errorhandler(HTTPException)
+def api_error(e):
+    if request.path.startswith('/api/'):
+        return jsonify({'error': e.description}), e.code
+    return e  # Flask's usual HTML error page
+
+@app.route('/api/conversations/<any(private, group):kind>/<int:peer_id>/messages', methods=['GET', 'POST'])
+@api_login_required
+def api_messages(kind, peer_id):
+    # GET ?after=<id>: messages newer than the cursor, oldest first (poll with the returned 'next').
+    # GET [?before=<id>]: the latest (or an older) page, as the chat page shows it.
+    # Either can add ?refresh=<id,...> to re-read messages whose media was still pending.
+    if request.method == 'POST':
+        data = request.get_json(silent=True) if request.is_json else request.form
+        content = str((data if isinstance(data, dict) else {}).get('content') or '').strip()
+        media = request.files.get('media')
+        has_media = bool(media and media.filename)
+        target = validate_message(kind, peer_id, content, has_media)
+        try:
+            msg_id = create_message(current_user.id, content, media if has_media else None, **target)
+        except Exception as e:
+            app.logger.warning('api_messages post failed: %s', e)
+            abort(500, 'Media upload failed.' if has_media else 'Message could not be sent.')
+        msg = db.session.get(Message, msg_id, options=[joinedload(Message.sender), joinedload(Message.media)])
+        return jsonify(message_payload(msg, current_user.id)), 201
+
+    if kind == 'private':
+        if load_user(peer_id) is None:
+            abort(404, 'Receiver missing.')
+        history = private_history_query(current_user.id, peer_id)
+        channel = private_channel(current_user.id, peer_id)
+    else:
+        if not is_member(peer_id, current_user.id):
+            Group.query.get_or_404(peer_id)
+            abort(403, 'Not a member of that group.')
+        history = group_history_query(peer_id)
+        channel = group_channel(peer_id)
+    last_message_id, last_modified = conversation_version(current_user.id, kind, peer_id)
+    pending = pending_media_version(current_user.id, kind, peer_id)
+    etag = page_etag(last_message_id, pending)
+    cached = not_modified(etag, last_modified)
+    if cached:
+        return cached
+
+    limit = max(1, min(request.args.get('limit', app.config['CHAT_PAGE_SIZE'], type=int), app.config['CHAT_PAGE_SIZE']))
+    after = request.args.get('after', type=int)
+    before = request.args.get('before', type=int)
+    loaded = history.options(joinedload(Message.sender), joinedload(Message.media))
+    body = {}
+    if after is not None:
+        rows = messages_after(history, after, last_message_id, limit + 1)
+        body['more'] = len(rows) > limit
+        rows = rows[:limit]
+    elif before is not None:
+        rows, body['older'] = paginate_messages(loaded, before=before, limit=limit)
+    else:
+        # The chat page's latest window (usually cached), trimmed to limit
+        rows, body['older'], _ = recent_messages(history, channel, (last_message_id, pending))
+        rows = list(rows)
+        if len(rows) > limit:
+            rows = rows[-limit:]
+            body['older'] = rows[0].id
+    body['messages'] = [message_payload(msg, current_user.id) for msg in rows]
+    body['next'] = rows[-1].id if rows else after or 0
+    refresh = [int(i) for i in request.args.get('refresh', '').split(',') if i.isdigit()][:limit]
+    if refresh:
+        body['updated'] = [message_payload(msg, current_user.id) for msg in loaded.filter(Message.id.in_(refresh))]
+    if rows and before is None:
+        mark_read(current_user.id, kind, peer_id)
+    return with_validators(jsonify(body), etag, last_modified)
+
+# --- Static Assets (fingerprinted, precompressed in memory, served immutable) ---
+_asset_manifest = {}  # 'nexus.css' -> entry
+_asset_files = {}  # 'nexus.<hash>.css' -> entry; the only names /assets serves
+_assets_loaded = False
+
+def _load_asset(name):
+    with open(os.path.join(app.static_folder, name), 'rb') as fh:
+        raw = fh.read()
+    digest = hashlib.sha256(raw).hexdigest()[:12]
+    stem, ext = os.path.splitext(name)
+    entry = {
+        'filename': f'{stem}.{digest}{ext}',
+        'digest': digest,
+        'mimetype': mimetypes.guess_type(name)[0] or 'application/octet-stream',
+        'identity': raw,
+        'gzip': gzip.compress(raw, 9, mtime=0),
+    }
+    if brotli:
+        entry['br'] = brotli.compress(raw, quality=11)
+    _asset_manifest[name] = entry
+    _asset_files[entry['filename']] = entry
+    return entry
+
+def _load_assets():
+    # Fingerprint every file in static/ once, on first use rather than at import
+    global _assets_loaded
+    for root, dirs, files in os.walk(app.static_folder):
+        for file in files:
+            _load_asset(os.path.relpath(os.path.join(root, file), app.static_folder).replace(os.sep, '/'))
+    _assets_loaded = True
+
+@app.template_global()
+def asset_url(name):
+    if not _assets_loaded or (app.debug and name not in _asset_manifest):
+        _load_assets()
+    elif app.debug:
+        _load_asset(name)  # Re-read so edits show up without a restart
+    return url_for('asset', filename=_asset_manifest[name]['filename'])
+
+@app.route('/assets/<path:filename>')
+def asset(filename):
+    if not _assets_loaded:
+        _load_assets()  # This worker may not have rendered a page yet
+    entry = _asset_files.get(filename)
+    if entry is None:
+        abort(404)  # Not a file in static/, or a stale fingerprint from an older deploy
+    encoding = next((enc for enc in ('br', 'gzip') if enc in entry and request.accept_encodings[enc]), 'identity')
+    response = Response(entry[encoding], mimetype=entry['mimetype'])
+    if encoding != 'identity':
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    response.set_etag(f"{entry['digest']}-{encoding}")
+    return response.make_conditional(request)
+
+# Uploads shown inline; any other extension (html, svg, ...) is sent as a download, so an upload
+# can never run script on this origin
+INLINE_MEDIA_TYPES = {
+    'png': 'image/png', 'jpg': 'image/jpeg', 'jpeg': 'image/jpeg', 'gif': 'image/gif', 'webp': 'image/webp',
+    'mp4': 'video/mp4', 'webm': 'video/webm', 'mp3': 'audio/mpeg', 'wav': 'audio/wav',
+}
+
 @app.route('/uploads/<path:filename>')
 def uploaded_file(filename):
-    abort(404)
+    # Local blob backend: Range (206), ETag/Last-Modified (304) and wsgi.file_wrapper/sendfile come from send_file
+    if not filename.startswith('chat-media/'):
+        abort(404)  # Never expose the staging queue
+    mimetype = INLINE_MEDIA_TYPES.get(filename.rsplit('.', 1)[-1].lower())
+    response = send_from_directory(
+        app.config['UPLOAD_FOLDER'], filename, conditional=True, etag=True, max_age=31536000,
+        mimetype=mimetype or 'application/octet-stream', as_attachment=mimetype is None
+    )
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'  # Paths are content hashes
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    response.headers['Content-Security-Policy'] = 'sandbox'  # Even if a browser renders it, no script or same-origin access
+    response.headers.setdefault('Accept-Ranges', 'bytes')  # Advertise seeking on the first, non-Range response too
+    return response
 
 # --- Vercel Handler (KEPT) ---
-handler = Mangum(app, lifespan="off")
+_mangum = None
+
+def handler(event, context):
+    # Mangum is built on the first invocation so importing this module stays cheap
+    global _mangum
+    if _mangum is None:
+        from mangum import Mangum
+        _mangum = Mangum(app, lifespan="off")
+    return _mangum(event, context)
 
 # --- Local Dev ---
 if __name__ == '__main__':
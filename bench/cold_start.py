@@ -0,0 +1,99 @@
+"""Cold-start cost of a fresh serverless instance: import time plus the first request, eager vs LAZY_INIT.
+
+    python bench/cold_start.py --runs 7 [--imports]
+
+Every run is a new interpreter that imports app and serves one GET /login, the way a fresh
+Lambda/Vercel instance handles its first hit. The request goes straight to the WSGI app (Mangum
+speaks ASGI to Flask's WSGI, so the handler adds nothing measurable here).
+Runs are made against a fresh database (first deploy) and an existing one (every later cold start).
+Prints median milliseconds for import, first request and their total. --imports adds the slowest
+modules app pulls in at import, from python -X importtime.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = '''
+import json, sys, time
+start = time.perf_counter()
+sys.path.insert(0, %r)
+import app
+imported = time.perf_counter()
+status = app.app.test_client().get('/login').status_code
+done = time.perf_counter()
+print(json.dumps({'status': status, 'import': imported - start, 'first_request': done - imported}))
+''' % ROOT
+
+
+def run_once(env):
+    out = subprocess.run([sys.executable, '-c', CHILD], env=env, capture_output=True, text=True, check=True).stdout
+    result = json.loads(out.strip().splitlines()[-1])  # app prints its DB init line first
+    if result['status'] != 200:
+        raise RuntimeError(f'First request returned {result["status"]}')
+    return result
+
+
+def measure(lazy, fresh_db, runs):
+    samples = []
+    for _ in range(runs):
+        tmp = tempfile.mkdtemp(prefix='chat4c-cold-')
+        env = dict(
+            os.environ,
+            DATABASE_URL=f'sqlite:///{tmp}/cold.db',
+            UPLOAD_FOLDER=os.path.join(tmp, 'uploads'),
+            TEMPLATE_CACHE_DIR=os.path.join(tmp, 'jinja'),
+            LAZY_INIT='1' if lazy else '0',
+        )
+        if not fresh_db:
+            subprocess.run([sys.executable, '-c', CHILD], env=env, capture_output=True, check=True)
+        samples.append(run_once(env))
+    median = lambda key: statistics.median(s[key] for s in samples) * 1000
+    return median('import'), median('first_request'), statistics.median((s['import'] + s['first_request']) for s in samples) * 1000
+
+
+def slowest_imports(limit):
+    # Cumulative time of modules imported directly by app. -X importtime prints children (one level
+    # deeper) before their parent, so keep the depth-1 entries seen since the previous top-level module.
+    err = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import sys; sys.path.insert(0, {ROOT!r}); import app'],
+                         env=dict(os.environ, LAZY_INIT='1'), capture_output=True, text=True).stderr
+    rows = []
+    for line in err.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        if depth == 0:
+            if name.strip() == 'app':
+                break
+            rows = []  # Children of some other top-level import (e.g. site)
+        elif depth == 1:
+            rows.append((int(cumulative), name.strip()))
+    return sorted(rows, reverse=True)[:limit]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5, help='fresh interpreters per configuration')
+    parser.add_argument('--imports', action='store_true', help='list the slowest imports of app')
+    args = parser.parse_args()
+
+    print(f'{"mode":<8} {"database":<10} {"import ms":>10} {"1st req ms":>11} {"total ms":>9}   (median of {args.runs})')
+    for fresh_db in (True, False):
+        for lazy in (False, True):
+            imported, first, total = measure(lazy, fresh_db, args.runs)
+            print(f'{"lazy" if lazy else "eager":<8} {"fresh" if fresh_db else "existing":<10} '
+                  f'{imported:>10.1f} {first:>11.1f} {total:>9.1f}')
+    if args.imports:
+        print('\nslowest imports under app (cumulative ms):')
+        for micros, name in slowest_imports(12):
+            print(f'  {micros / 1000:8.1f}  {name}')
+
+
+if __name__ == '__main__':
+    main()
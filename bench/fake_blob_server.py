@@ -0,0 +1,110 @@
+"""Local stand-in for the blob storage HTTP API, for exercising upload_blob without a real token.
+
+    python bench/fake_blob_server.py --port 8765 [--fail-every 3]
+    BLOB_API_URL=http://127.0.0.1:8765 BLOB_READ_WRITE_TOKEN=test python app.py
+
+PUT /<pathname> streams the body to disk in small reads and answers {"url": ...}; GET serves it
+back. --fail-every N answers every Nth PUT with 503 so upload retries can be observed.
+"""
+import argparse
+import json
+import os
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CHUNK = 64 * 1024
+
+
+class BlobHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep-alive, so connection reuse by the client is visible
+
+    def _read_body(self, out):
+        size = 0
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            while True:
+                length = int(self.rfile.readline().split(b';')[0], 16)
+                if not length:
+                    self.rfile.readline()
+                    break
+                size += self._copy(out, length)
+                self.rfile.readline()
+        else:
+            size = self._copy(out, int(self.headers.get('Content-Length', 0)))
+        return size
+
+    def _copy(self, out, remaining):
+        copied = 0
+        while remaining:
+            chunk = self.rfile.read(min(CHUNK, remaining))
+            if not chunk:
+                break
+            out.write(chunk)
+            copied += len(chunk)
+            remaining -= len(chunk)
+        return copied
+
+    def _reply(self, status, body, content_type='application/json'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_PUT(self):
+        server = self.server
+        with server.lock:
+            server.puts += 1
+            failing = server.fail_every and server.puts % server.fail_every == 0
+            server.connections.add(self.client_address)
+        if failing:
+            self._read_body(open(os.devnull, 'wb'))
+            self._reply(503, b'{"error": "injected failure"}')
+            return
+        pathname = self.path.lstrip('/')
+        target = os.path.join(server.root, pathname)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, 'wb') as out:
+            size = self._read_body(out)
+        url = f'http://{self.headers.get("Host")}/{pathname}'
+        self._reply(200, json.dumps({'url': url, 'pathname': pathname, 'size': size}).encode())
+
+    def do_GET(self):
+        target = os.path.join(self.server.root, self.path.lstrip('/'))
+        if not os.path.isfile(target):
+            self._reply(404, b'{}')
+            return
+        with open(target, 'rb') as fh:
+            self._reply(200, fh.read(), 'application/octet-stream')
+
+    def log_message(self, *args):
+        pass
+
+
+def start_server(port=0, root=None, fail_every=0):
+    server = ThreadingHTTPServer(('127.0.0.1', port), BlobHandler)
+    server.root = root or tempfile.mkdtemp(prefix='chat4c-blobs-')
+    server.fail_every = fail_every
+    server.puts = 0
+    server.connections = set()
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--root', help='Directory to store blobs in (default: a temp dir)')
+    parser.add_argument('--fail-every', type=int, default=0)
+    args = parser.parse_args()
+    server, url = start_server(args.port, args.root, args.fail_every)
+    print(f'Fake blob server on {url}, storing in {server.root}')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""Shared setup for the bench scripts: a throwaway app instance and a bulk-seeded database.
+
+    from fixtures import open_app, seed
+    chat = open_app(CHAT_PAGE_SIZE='5000')
+    with chat.app.app_context(), chat.db.engine.begin() as conn:
+        seed(chat, conn, users=2, messages=5000, pair_share=1)
+
+Rows go straight through the connection, so large histories take seconds; conversation summaries
+are rebuilt afterwards since raw inserts bypass the ORM hook that maintains the inbox.
+"""
+import datetime
+import os
+import random
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+EPOCH = datetime.datetime(2024, 1, 1)
+
+
+def open_app(**env):
+    # Database and uploads in a new temp dir (never the app's persistent defaults), then import app.
+    # env: app settings to override, applied before the import since app reads them at import time.
+    tmp = tempfile.mkdtemp(prefix='chat4c-bench-')
+    os.environ['DATABASE_URL'] = f'sqlite:///{tmp}/bench.db'
+    os.environ['UPLOAD_FOLDER'] = os.path.join(tmp, 'uploads')
+    os.environ.setdefault('MESSAGE_BUS', 'local')
+    os.environ.update(env)
+    import app
+    return app
+
+
+def seed(chat, conn, users, groups=0, members=0, messages=0, private_share=0.5, pair_share=0.0,
+         padding=0, per_second=1, rng=None):
+    # users user1..N (password 'pw'); groups group1..G with `members` random members each. Of the messages,
+    # pair_share go between users 1 and 2, private_share of the rest between random users, and the others
+    # to a random group from one of its members. per_second > 1 gives timestamp ties, as under load.
+    # Returns {user_id: [group ids]}.
+    rng = rng or random.Random(42)
+    conn.exec_driver_sql(
+        'INSERT INTO user (id, username, password) VALUES (?, ?, ?)',
+        [(i, f'user{i}', 'pw') for i in range(1, users + 1)],
+    )
+    membership = {uid: [] for uid in range(1, users + 1)}
+    group_members = {}
+    if groups:
+        conn.exec_driver_sql(
+            'INSERT INTO "group" (id, name) VALUES (?, ?)',
+            [(i, f'group{i}') for i in range(1, groups + 1)],
+        )
+        rows = []
+        for gid in range(1, groups + 1):
+            group_members[gid] = rng.sample(range(1, users + 1), min(users, members))
+            for uid in group_members[gid]:
+                membership[uid].append(gid)
+                rows.append((gid, uid))
+        conn.exec_driver_sql('INSERT INTO group_member (group_id, user_id) VALUES (?, ?)', rows)
+    group_ids = [gid for gid, uids in group_members.items() if uids]
+    suffix = ' lorem ipsum' * padding
+    rows = []
+    for i in range(messages):
+        ts = (EPOCH + datetime.timedelta(seconds=i // per_second)).strftime('%Y-%m-%d %H:%M:%S')
+        if users > 1 and rng.random() < pair_share:
+            sender, receiver = rng.choice([(1, 2), (2, 1)])
+            rows.append((sender, receiver, None, f'private message {i} from {sender}{suffix}', ts))
+        elif users > 1 and (not group_ids or rng.random() < private_share):
+            sender, receiver = rng.sample(range(1, users + 1), 2)
+            rows.append((sender, receiver, None, f'private message {i} from {sender}{suffix}', ts))
+        else:
+            gid = rng.choice(group_ids)
+            rows.append((rng.choice(group_members[gid]), None, gid, f'group message {i} in {gid}{suffix}', ts))
+    if rows:
+        conn.exec_driver_sql(
+            'INSERT INTO message (sender_id, receiver_id, group_id, content, timestamp) VALUES (?, ?, ?, ?, ?)',
+            rows,
+        )
+    chat.rebuild_conversations(conn)
+    return membership
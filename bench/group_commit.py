@@ -0,0 +1,66 @@
+"""Burst of concurrent message inserts with and without group commit (WRITE_BATCHING).
+
+    python bench/group_commit.py --threads 32 --messages 50 [--profile production]
+
+Each thread plays one group member posting --messages texts back to back through create_message,
+the path send_message and group_chat use. Prints throughput, per-message latency and, for the
+batched run, the batch stats that /metrics/writes reports.
+"""
+import argparse
+import threading
+import time
+
+from fixtures import open_app, seed
+
+
+def burst(chat, threads, messages, group_id):
+    latencies = []
+    lock = threading.Lock()
+
+    def member(user_id):
+        mine = []
+        with chat.app.app_context():
+            for i in range(messages):
+                start = time.perf_counter()
+                chat.create_message(user_id, f'burst {user_id}/{i}', group_id=group_id)
+                mine.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(mine)
+
+    workers = [threading.Thread(target=member, args=(uid,)) for uid in range(1, threads + 1)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return elapsed, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--messages', type=int, default=50)
+    parser.add_argument('--profile', default='default', help="SQLITE_PROFILE to run under")
+    args = parser.parse_args()
+
+    chat = open_app(SQLITE_PROFILE=args.profile, MESSAGE_BUS='local')
+    with chat.app.app_context(), chat.db.engine.begin() as conn:
+        seed(chat, conn, users=args.threads, groups=1, members=args.threads)
+    group_id = 1
+
+    total = args.threads * args.messages
+    print(f'{total} messages from {args.threads} threads, SQLITE_PROFILE={args.profile}')
+    for batching in (False, True):
+        chat.app.config['WRITE_BATCHING'] = batching
+        elapsed, latencies = burst(chat, args.threads, args.messages, group_id)
+        p50 = latencies[len(latencies) // 2] * 1000
+        p99 = latencies[int(len(latencies) * 0.99)] * 1000
+        label = 'group commit' if batching else 'commit per message'
+        print(f'{label:<20} {total / elapsed:9.0f} msg/s   p50 {p50:7.2f} ms   p99 {p99:7.2f} ms')
+    print('batch stats:', chat.write_batcher.stats())
+
+
+if __name__ == '__main__':
+    main()
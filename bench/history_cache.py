@@ -0,0 +1,74 @@
+"""Repeated views of a busy group page with the recent-history cache off and on (HISTORY_CACHE_SIZE).
+
+    python bench/history_cache.py --members 20 --messages 5000 --views 500 --post-every 20
+
+Members take turns viewing GET /group/1 through the test client, with one member posting every
+--post-every views so windows keep being retired and refilled the way a live group's are. Prints
+per-view latency, SQL statements per view and, for the cached run, the stats /metrics/caches reports.
+"""
+import argparse
+import time
+
+from sqlalchemy import event
+
+from fixtures import open_app, seed
+
+
+def run(engine, clients, views, post_every):
+    statements = [0]
+    listener = lambda *args: statements.__setitem__(0, statements[0] + 1)
+    event.listen(engine, 'before_cursor_execute', listener)
+    latencies, view_statements = [], 0
+    try:
+        for i in range(views):
+            if post_every and i % post_every == post_every - 1:
+                clients[i % len(clients)].post('/group/1', data={'message': f'post {i}'})
+            before = statements[0]
+            start = time.perf_counter()
+            response = clients[i % len(clients)].get('/group/1')
+            response.get_data()
+            latencies.append(time.perf_counter() - start)
+            view_statements += statements[0] - before
+    finally:
+        event.remove(engine, 'before_cursor_execute', listener)
+    latencies.sort()
+    return latencies, view_statements / views
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--members', type=int, default=20)
+    parser.add_argument('--messages', type=int, default=5000)
+    parser.add_argument('--views', type=int, default=500)
+    parser.add_argument('--post-every', type=int, default=20, help='views between posts (0: no posts)')
+    args = parser.parse_args()
+
+    chat = open_app()
+
+    with chat.app.app_context():
+        engine = chat.db.engine
+        with engine.begin() as conn:
+            seed(chat, conn, users=args.members, groups=1, members=args.members, messages=args.messages,
+                 private_share=0, padding=4)
+
+    clients = []
+    for uid in range(1, args.members + 1):
+        client = chat.app.test_client()
+        client.post('/login', data={'username': f'user{uid}', 'password': 'pw'})
+        clients.append(client)
+
+    size = chat.app.config['HISTORY_CACHE_SIZE']
+    print(f'{args.views} views of a {args.messages}-message group, a post every {args.post_every} views')
+    for enabled in (False, True):
+        chat.app.config['HISTORY_CACHE_SIZE'] = size if enabled else 0
+        chat.history_cache.clear()
+        latencies, per_view = run(engine, clients, args.views, args.post_every)
+        p50 = latencies[len(latencies) // 2] * 1000
+        p95 = latencies[int(len(latencies) * 0.95)] * 1000
+        label = 'cache on' if enabled else 'cache off'
+        print(f'{label:<10} p50 {p50:7.2f} ms   p95 {p95:7.2f} ms   {per_view:5.2f} statements/view')
+    print('cache stats:', chat.history_cache.stats())
+
+
+if __name__ == '__main__':
+    main()
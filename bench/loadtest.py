@@ -0,0 +1,224 @@
+"""Seed a synthetic database and load-test the main routes, saving results for comparison.
+
+    python bench/loadtest.py --users 2000 --groups 100 --members 40 --messages 200000 \\
+        --requests 500 --concurrency 8 [--mode http] [--compare bench/results/<earlier>.json]
+
+Routes run one after another (login, home, private_chat, group_chat, send_message), each with
+--requests requests spread over --concurrency threads, every thread logged in as a random seeded
+user. --mode client uses the Flask test client; --mode http starts a threaded werkzeug server in
+this process and talks to it over HTTP. upload_blob is stubbed, so --media-ratio of the sends
+carry a small attachment without touching blob storage.
+
+Per route it reports p50/p95/p99 latency, throughput and peak RSS of the process (server and
+clients share it in both modes). Results go to bench/results/<commit>-<time>.json; --compare
+prints the change against an earlier file.
+"""
+import argparse
+import io
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import threading
+import time
+
+from fixtures import ROOT, open_app, seed
+
+ROUTES = ['login', 'home', 'private_chat', 'group_chat', 'send_message']
+PNG = (b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x01\x00\x00\x00\x01\x08\x06\x00\x00\x00\x1f\x15\xc4\x89'
+       b'\x00\x00\x00\rIDATx\x9cc\xf8\x0f\x00\x00\x01\x01\x00\x05\x18\xd8N\x00\x00\x00\x00IEND\xaeB`\x82')
+
+
+class TestClientSession:
+    def __init__(self, chat):
+        self.client = chat.app.test_client()
+
+    def get(self, path):
+        return self._finish(self.client.get(path))
+
+    def post(self, path, data):
+        return self._finish(self.client.post(path, data=data, content_type='multipart/form-data'))
+
+    @staticmethod
+    def _finish(response):
+        # Chat pages are streamed: read the whole body, then close so call_on_close work (history cache
+        # fill, request metrics) runs inside the timing, as it does over HTTP
+        response.get_data()
+        response.close()
+        return response.status_code
+
+
+class HttpSession:
+    def __init__(self, base_url):
+        import requests
+        self.base_url = base_url
+        self.session = requests.Session()
+
+    def get(self, path):
+        return self.session.get(self.base_url + path, allow_redirects=False).status_code
+
+    def post(self, path, data):
+        # Werkzeug's test client takes (stream, filename); requests wants (filename, stream)
+        files = {key: (value[1], value[0]) for key, value in data.items() if isinstance(value, tuple)}
+        fields = {key: value for key, value in data.items() if not isinstance(value, tuple)}
+        return self.session.post(self.base_url + path, data=fields, files=files or None, allow_redirects=False).status_code
+
+
+def make_request(route, session, user_id, args, membership, rng):
+    if route == 'login':
+        return session.post('/login', {'username': f'user{user_id}', 'password': 'pw'})
+    if route == 'home':
+        return session.get('/')
+    if route == 'private_chat':
+        return session.get(f'/private/{rng.randint(1, args.users)}')
+    if route == 'group_chat':
+        groups = membership[user_id]
+        return session.get(f'/group/{rng.choice(groups)}' if groups else '/groups')
+    data = {'content': f'load test {rng.random():.6f}'}
+    if membership[user_id] and rng.random() < 0.5:
+        data.update(chat_type='group', group_id=str(rng.choice(membership[user_id])))
+    else:
+        data.update(chat_type='private', receiver_id=str(rng.randint(1, args.users)))
+    if rng.random() < args.media_ratio:
+        data['media'] = (io.BytesIO(PNG + os.urandom(16)), 'load.png')  # Unique bytes: no dedup shortcut
+    return session.post('/send_message', data)
+
+
+def peak_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024  # bytes on macOS, KiB on Linux
+
+
+def run_route(route, new_session, args, membership, seed_value):
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+    per_thread = [args.requests // args.concurrency + (i < args.requests % args.concurrency) for i in range(args.concurrency)]
+
+    def worker(index, count):
+        nonlocal errors
+        rng = random.Random(seed_value + index)
+        user_id = rng.randint(1, args.users)
+        session = new_session()
+        session.post('/login', {'username': f'user{user_id}', 'password': 'pw'})
+        mine, failed = [], 0
+        for _ in range(count):
+            start = time.perf_counter()
+            try:
+                failed += make_request(route, session, user_id, args, membership, rng) >= 400
+            except Exception:
+                failed += 1  # e.g. connection reset under load
+            mine.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(mine)
+            errors += failed
+
+    threads = [threading.Thread(target=worker, args=(i, n)) for i, n in enumerate(per_thread) if n]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    pick = lambda fraction: round(latencies[min(len(latencies) - 1, int(fraction * len(latencies)))] * 1000, 3)
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput_rps': round(len(latencies) / elapsed, 1),
+        'p50_ms': pick(0.50),
+        'p95_ms': pick(0.95),
+        'p99_ms': pick(0.99),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def print_results(results, previous=None):
+    header = f'{"route":<14} {"req":>6} {"err":>4} {"rps":>8} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} {"rss MB":>8}'
+    print(header + ('   vs previous (p95, rps)' if previous else ''))
+    for route, r in results.items():
+        line = (f'{route:<14} {r["requests"]:>6} {r["errors"]:>4} {r["throughput_rps"]:>8} {r["p50_ms"]:>9} '
+                f'{r["p95_ms"]:>9} {r["p99_ms"]:>9} {r["peak_rss_mb"]:>8}')
+        old = (previous or {}).get(route)
+        if old:
+            line += (f'   {(r["p95_ms"] / old["p95_ms"] - 1) * 100:+6.1f}%  '
+                     f'{(r["throughput_rps"] / old["throughput_rps"] - 1) * 100:+6.1f}%')
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--groups', type=int, default=50)
+    parser.add_argument('--members', type=int, default=30, help='members per group')
+    parser.add_argument('--messages', type=int, default=50000)
+    parser.add_argument('--requests', type=int, default=300, help='requests per route')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--media-ratio', type=float, default=0.1, help='share of sends with an attachment')
+    parser.add_argument('--routes', default=','.join(ROUTES))
+    parser.add_argument('--mode', choices=['client', 'http'], default='client')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='results file (default: bench/results/<commit>-<time>.json)')
+    parser.add_argument('--compare', help='earlier results file to diff against')
+    args = parser.parse_args()
+
+    chat = open_app(UPLOAD_MODE='inline')  # Measure the send itself, not a background queue
+    chat.upload_blob = lambda stream, pathname: f'/uploads/{pathname}'  # Stub: no blob storage I/O
+
+    rng = random.Random(args.seed)
+    start = time.perf_counter()
+    with chat.app.app_context():
+        with chat.db.engine.begin() as conn:
+            membership = seed(chat, conn, args.users, args.groups, args.members, args.messages, rng=rng)
+            conn.exec_driver_sql('ANALYZE')
+    print(f'Seeded {args.users} users, {args.groups} groups x {args.members} members, '
+          f'{args.messages} messages in {time.perf_counter() - start:.1f}s')
+
+    server = None
+    if args.mode == 'http':
+        import logging
+        from werkzeug.serving import make_server
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)  # No per-request access log
+        server = make_server('127.0.0.1', 0, chat.app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f'http://127.0.0.1:{server.server_port}'
+        new_session = lambda: HttpSession(base_url)
+    else:
+        new_session = lambda: TestClientSession(chat)
+
+    results = {}
+    for i, route in enumerate(args.routes.split(',')):
+        results[route] = run_route(route, new_session, args, membership, args.seed * 1000 + i * 100)
+    if server:
+        server.shutdown()
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as fh:
+            previous = json.load(fh)['results']
+    print_results(results, previous)
+
+    commit = git_commit()
+    output = args.output or os.path.join(ROOT, 'bench', 'results', f'{commit}-{time.strftime("%Y%m%d-%H%M%S")}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    config = {key: value for key, value in vars(args).items() if key not in ('output', 'compare')}
+    # App settings overridden from the environment (e.g. SQLITE_PROFILE, WRITE_BATCHING), minus our temp paths
+    env = {key: os.environ[key] for key in chat.app.config if key in os.environ and key != 'UPLOAD_FOLDER'}
+    with open(output, 'w') as fh:
+        json.dump({'commit': commit, 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'config': config, 'env': env,
+                   'results': results}, fh, indent=2)
+    print(f'Saved {output}')
+
+
+if __name__ == '__main__':
+    main()
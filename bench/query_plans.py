@@ -0,0 +1,75 @@
+"""Seed a throwaway database and show that the chat history queries use the Message indexes.
+
+    python bench/query_plans.py --messages 200000
+
+Prints EXPLAIN QUERY PLAN and median latency for each access pattern, first with the
+indexes created by migrate_db() and then with them dropped for comparison.
+"""
+import argparse
+import time
+
+from fixtures import open_app, seed
+
+
+def sql_of(query, engine):
+    return str(query.statement.compile(engine, compile_kwargs={'literal_binds': True}))
+
+
+def measure(conn, sql, repeat):
+    plan = [row[-1] for row in conn.exec_driver_sql(f'EXPLAIN QUERY PLAN {sql}')]
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        conn.exec_driver_sql(sql).fetchall()
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return plan, samples[len(samples) // 2] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--groups', type=int, default=50)
+    parser.add_argument('--messages', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    chat = open_app()
+
+    with chat.app.app_context():
+        engine = chat.db.engine
+        with engine.begin() as conn:
+            # One busy pair for the private cases; many ties per timestamp second
+            seed(chat, conn, args.users, args.groups, members=20, messages=args.messages, pair_share=0.05, per_second=1000)
+            conn.exec_driver_sql('ANALYZE')
+        pivot = chat.db.session.execute(
+            chat.db.select(chat.Message.id).where(chat.Message.group_id == 1)
+            .order_by(chat.Message.id).offset(chat.Message.query.filter_by(group_id=1).count() // 2)
+        ).scalar()
+        page = chat.app.config['CHAT_PAGE_SIZE']
+        cases = {
+            'home inbox': chat.db.session.query(chat.Conversation).filter_by(user_id=1)
+                          .order_by(chat.Conversation.last_message_id.desc()).limit(chat.app.config['INBOX_SIZE']),
+            'group chat (latest page)': chat.keyset_page_query(chat.group_history_query(1), None, page),
+            'group chat (older page)': chat.keyset_page_query(chat.group_history_query(1), pivot, page),
+            'private chat (latest page)': chat.keyset_page_query(chat.private_history_query(1, 2), None, page),
+            'group pending media (ETag)': chat.pending_media_query(1, 'group', 1),
+            'private pending media (ETag)': chat.pending_media_query(1, 'private', 2),
+        }
+        statements = {name: sql_of(q, engine) for name, q in cases.items()}
+
+        indexes = [*chat.Message.__table__.indexes, *chat.GroupMember.__table__.indexes, *chat.Conversation.__table__.indexes]
+        for label in ('with indexes', 'without indexes'):
+            print(f'=== {label} ({args.messages} messages) ===')
+            with engine.connect() as conn:
+                for name, sql in statements.items():
+                    plan, ms = measure(conn, sql, args.repeat)
+                    print(f'{name:<28} {ms:9.3f} ms  ' + ' | '.join(plan))
+            with engine.begin() as conn:
+                for index in indexes:
+                    conn.exec_driver_sql(f'DROP INDEX IF EXISTS {index.name}')  # Reflection can't see expression indexes
+            engine.dispose()  # Drop cached statements planned against the old schema
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""Per-route template render cost: one monolithic render_template_string vs. precompiled page templates.
+
+    python bench/render_templates.py --messages 50 --repeat 200
+
+"before" rebuilds the old single NEXUS_HTML string (base.html with every page body behind an
+{% if page == ... %} chain) and renders it with render_template_string, which re-parses and
+re-compiles it on every call. "after" is render_template on the per-page file, as the routes do now.
+"""
+import argparse
+import re
+import time
+
+from fixtures import open_app, seed
+
+PAGES = ['login', 'register', 'home', 'groups', 'private_chat', 'group_chat']
+
+
+def build_monolith(env):
+    base = env.loader.get_source(env, 'base.html')[0]
+    bodies = []
+    for page in PAGES:
+        source = env.loader.get_source(env, f'{page}.html')[0]
+        body = re.search(r'{% block content %}\n(.*){% endblock %}', source, re.S).group(1)
+        bodies.append(f"{{% if page == '{page}' %}}\n{body}{{% endif %}}\n")
+    return base.replace('{% block content %}{% endblock %}', '\n'.join(bodies))
+
+
+def contexts(chat, alice, bob, group):
+    private, older = chat.paginate_messages(chat.private_history_query(alice.id, bob.id))
+    grouped, group_older = chat.paginate_messages(chat.group_history_query(group.id))
+    user_groups = chat.Group.query.join(chat.GroupMember).filter(chat.GroupMember.user_id == alice.id).all()
+    return {
+        'login': {'page_title': 'Login'},
+        'register': {'page_title': 'Register'},
+        'home': {
+            'page_title': 'Home',
+            'user_groups': user_groups,
+            'contacts': chat.recent_contacts(alice.id),
+            'query': '',
+            'matches': [],
+            'next_cursor': None,
+            'conversations': chat.inbox_conversations(alice.id, chat.app.config['INBOX_SIZE']),
+        },
+        'groups': {
+            'page_title': 'Groups',
+            'groups': user_groups,
+            'member_counts': {g.id: len(chat.group_members_cached(g.id)) for g in user_groups},
+        },
+        'private_chat': {'page_title': 'Chat', 'receiver': bob, 'messages': private, 'older_cursor': older,
+                         'newest_id': private[-1].id if private else None},
+        'group_chat': {'page_title': group.name, 'group': group, 'messages': grouped, 'older_cursor': group_older,
+                       'newest_id': grouped[-1].id if grouped else None},
+    }
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return samples[len(samples) // 2] * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    chat = open_app()
+    from flask import render_template, render_template_string
+    from flask_login import login_user
+
+    monolith = build_monolith(chat.app.jinja_env)
+    with chat.app.app_context(), chat.db.engine.begin() as conn:
+        seed(chat, conn, users=2, groups=1, members=2, messages=args.messages * 2)  # About half private, half group
+    with chat.app.test_request_context('/'):
+        alice, bob = chat.db.session.get(chat.User, 1), chat.db.session.get(chat.User, 2)
+        group = chat.db.session.get(chat.Group, 1)
+        login_user(alice)
+        pages = contexts(chat, alice, bob, group)
+        print(f'{"route":<14} {"before (us)":>12} {"after (us)":>12} {"speedup":>8}')
+        for page, ctx in pages.items():
+            render_template(f'{page}.html', **ctx)  # Warm the compiled-template cache once
+            before = timed(lambda: render_template_string(monolith, page=page, **ctx), args.repeat)
+            after = timed(lambda: render_template(f'{page}.html', **ctx), args.repeat)
+            print(f'{page:<14} {before:12.1f} {after:12.1f} {before / after:7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
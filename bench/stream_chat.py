@@ -0,0 +1,78 @@
+"""Time to first byte and peak memory of a long chat page: buffered render vs. the streamed route.
+
+    python bench/stream_chat.py --messages 5000 --repeat 5
+
+The page size is raised to --messages so the whole history is one page. "buffered" loads the page
+with paginate_messages and renders it with render_template, as private_chat did before; "streamed"
+is GET /private/<id> through the test client, consumed chunk by chunk. Peak memory is the
+tracemalloc high-water mark for the request.
+"""
+import argparse
+import statistics
+import time
+import tracemalloc
+
+from fixtures import open_app, seed
+
+
+def measure(fn, repeat):
+    # fn() yields the response in pieces; returns median (first byte ms, total ms) and max peak KiB
+    first, total, peaks = [], [], []
+    for _ in range(repeat):
+        tracemalloc.start()
+        start = time.perf_counter()
+        pieces = iter(fn())
+        next(pieces)
+        first.append(time.perf_counter() - start)
+        for _ in pieces:
+            pass
+        total.append(time.perf_counter() - start)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return statistics.median(first) * 1000, statistics.median(total) * 1000, max(peaks) / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    chat = open_app(CHAT_PAGE_SIZE=str(args.messages))
+    from flask import render_template
+    from flask_login import login_user
+
+    with chat.app.app_context():
+        with chat.db.engine.begin() as conn:
+            seed(chat, conn, users=2, messages=args.messages, pair_share=1, padding=8)
+
+    def buffered():
+        with chat.app.test_request_context('/private/2'):
+            login_user(chat.db.session.get(chat.User, 1))
+            messages, older = chat.paginate_messages(
+                chat.private_history_query(1, 2).options(chat.joinedload(chat.Message.sender), chat.joinedload(chat.Message.media))
+            )
+            html = render_template('private_chat.html', receiver=chat.db.session.get(chat.User, 2), messages=messages,
+                                   older_cursor=older, newest_id=messages[-1].id, page_title='Chat')
+            chat.db.session.remove()
+        return [html]
+
+    client = chat.app.test_client()
+    client.post('/login', data={'username': 'user1', 'password': 'pw'})
+
+    def streamed():
+        response = client.get('/private/2', buffered=False)
+        try:
+            yield from response.response
+        finally:
+            response.close()
+
+    print(f'{args.messages} messages on one page')
+    print(f'{"":<10} {"first byte ms":>14} {"total ms":>9} {"peak KiB":>9}')
+    for label, fn in (('buffered', buffered), ('streamed', streamed)):
+        fn_first, fn_total, peak = measure(fn, args.repeat)
+        print(f'{label:<10} {fn_first:>14.1f} {fn_total:>9.1f} {peak:>9.0f}')
+
+
+if __name__ == '__main__':
+    main()
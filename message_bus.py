@@ -0,0 +1,172 @@
+"""In-process pub/sub with an optional cross-process transport.
+
+Subscribers (e.g. SSE streams) block on a Subscription until something is published on their
+channel. With the Unix socket transport every worker process binds a datagram socket in a shared
+directory and publishes are relayed to all of them, so a commit in one gunicorn worker wakes the
+streams held by the others without any of them polling the database. Anyone who can write to that
+directory can read and forge every publish, so it must be private to the deployment's user.
+"""
+import atexit
+import json
+import os
+import socket
+import stat
+import threading
+from collections import defaultdict, deque
+
+
+class Subscription:
+    def __init__(self, bus, channel):
+        self.bus = bus
+        self.channel = channel
+        self.pending = deque(maxlen=256)  # Payloads not yet drained; oldest dropped if the reader stalls
+        self._event = threading.Event()
+
+    def notify(self, payload):
+        self.pending.append(payload)
+        self._event.set()
+
+    def drain(self):
+        payloads = []
+        while self.pending:
+            payloads.append(self.pending.popleft())
+        return payloads
+
+    def wait(self, timeout=None):
+        # Cleared before the caller re-reads state, so a publish racing with the read still fires next wait
+        fired = self._event.wait(timeout)
+        self._event.clear()
+        return fired
+
+    def close(self):
+        self.bus.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class LocalTransport:
+    # Single process: publishes only reach subscribers in this interpreter
+    def start(self, deliver):
+        pass
+
+    def send(self, channel, payload):
+        pass
+
+
+def _make_private_dir(path):
+    # Created 0700; an existing directory is only used if it is ours and nobody else can get in
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise PermissionError(f'Message bus directory {path} must be a directory owned by this user with mode 0700')
+
+
+class UnixSocketTransport:
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = None
+        self._sender = None
+
+    def start(self, deliver):
+        _make_private_dir(self.directory)
+        self.path = os.path.join(self.directory, f'{os.getpid()}.sock')
+        if os.path.exists(self.path):
+            os.unlink(self.path)  # Left behind by a dead process that had our pid
+        receiver = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        receiver.bind(self.path)
+        self._sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sender.setblocking(False)  # A stuck worker must never block a request thread
+        threading.Thread(target=self._receive, args=(receiver, deliver), daemon=True).start()
+        atexit.register(self._cleanup, self.path)
+
+    def _receive(self, receiver, deliver):
+        while True:
+            data = receiver.recv(65536)
+            try:
+                frame = json.loads(data)
+                deliver(frame['c'], frame['p'])
+            except (ValueError, KeyError):
+                continue
+
+    def send(self, channel, payload):
+        data = json.dumps({'c': channel, 'p': payload}).encode()
+        for name in os.listdir(self.directory):
+            peer = os.path.join(self.directory, name)
+            if peer == self.path or not name.endswith('.sock'):
+                continue
+            try:
+                self._sender.sendto(data, peer)
+            except (ConnectionRefusedError, FileNotFoundError):
+                self._cleanup(peer)  # Worker exited without unlinking its socket
+            except OSError:
+                pass  # Peer queue full; its streams catch up on their next fallback check
+
+    @staticmethod
+    def _cleanup(path):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+class MessageBus:
+    def __init__(self, transport=None):
+        self.transport = transport or LocalTransport()
+        self._subscribers = defaultdict(set)
+        self._listeners = defaultdict(list)
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def start(self):
+        # Started lazily per process so gunicorn --preload forks don't share the parent's socket/thread
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self.transport.start(self._deliver)
+                    self._pid = os.getpid()
+
+    def subscribe(self, channel):
+        self.start()
+        sub = Subscription(self, channel)
+        with self._lock:
+            self._subscribers[channel].add(sub)
+        return sub
+
+    def listen(self, channel, callback):
+        # callback(payload) runs on the publishing thread locally and on the receive thread in other
+        # processes; those only hear it once they've called start()
+        with self._lock:
+            self._listeners[channel].append(callback)
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            subs = self._subscribers.get(sub.channel)
+            if subs:
+                subs.discard(sub)
+                if not subs:
+                    del self._subscribers[sub.channel]
+
+    def publish(self, channel, payload=None):
+        self.start()
+        self._deliver(channel, payload)
+        self.transport.send(channel, payload)
+
+    def _deliver(self, channel, payload):
+        with self._lock:
+            subs = list(self._subscribers.get(channel, ()))
+            listeners = list(self._listeners.get(channel, ()))
+        for sub in subs:
+            sub.notify(payload)
+        for callback in listeners:
+            callback(payload)
+
+
+def create_bus(kind, directory):
+    # directory: one per deployment; all its workers must use the same one
+    if kind == 'unix' and hasattr(socket, 'AF_UNIX'):
+        return MessageBus(UnixSocketTransport(directory))
+    return MessageBus(LocalTransport())
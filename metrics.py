@@ -0,0 +1,110 @@
+"""Minimal Prometheus text-format metrics: labelled counters and histograms, plus collectors.
+
+No client library needed. Families are updated under one lock, and render() produces the
+exposition format. Collectors are callables run at scrape time that return families built
+from stats other components already keep (queues, caches), so those cost nothing between scrapes.
+"""
+import bisect
+import threading
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, help, labels, lock):
+        self.name, self.help, self.labels = name, help, labels
+        self._lock = lock
+        self._values = {}
+
+    def inc(self, label_values=(), amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        for values, total in sorted(self._values.items()):
+            yield self.name, _labels(self.labels, values), total
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name, help, labels, lock, buckets=DEFAULT_BUCKETS):
+        self.name, self.help, self.labels = name, help, labels
+        self.buckets = tuple(buckets)
+        self._lock = lock
+        self._values = {}  # label values -> [per-bucket counts..., +Inf count, sum]
+
+    def observe(self, label_values, value):
+        with self._lock:
+            state = self._values.get(label_values)
+            if state is None:
+                state = self._values[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            state[bisect.bisect_left(self.buckets, value)] += 1
+            state[-1] += value
+
+    def samples(self):
+        for values, state in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), state):
+                cumulative += count
+                yield f'{self.name}_bucket', _labels(self.labels, values, ('le', _number(bound))), cumulative
+            yield f'{self.name}_sum', _labels(self.labels, values), state[-1]
+            yield f'{self.name}_count', _labels(self.labels, values), cumulative
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._families = []
+        self._collectors = []
+
+    def counter(self, name, help, labels=()):
+        family = Counter(name, help, tuple(labels), self._lock)
+        self._families.append(family)
+        return family
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        family = Histogram(name, help, tuple(labels), self._lock, buckets)
+        self._families.append(family)
+        return family
+
+    def collector(self, fn):
+        # fn() -> iterable of (name, type, help, [(labels dict, value), ...]); usable as a decorator
+        self._collectors.append(fn)
+        return fn
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for family in self._families:
+                lines.append(f'# HELP {family.name} {family.help}')
+                lines.append(f'# TYPE {family.name} {family.type}')
+                lines.extend(f'{name}{labels} {_number(value)}' for name, labels, value in family.samples())
+        for fn in self._collectors:
+            for name, kind, help, samples in fn():
+                lines.append(f'# HELP {name} {help}')
+                lines.append(f'# TYPE {name} {kind}')
+                for labels, value in samples:
+                    lines.append(f'{name}{_labels(tuple(labels), tuple(labels.values()))} {_number(value)}')
+        return '\n'.join(lines) + '\n'
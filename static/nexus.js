@@ -0,0 +1,174 @@
+document.addEventListener('DOMContentLoaded', () => {
+  ['messages', 'group-messages'].forEach(id => {
+    const el = document.getElementById(id);
+    if (el) el.scrollTop = el.scrollHeight;
+  });
+
+  document.querySelectorAll('.nexus-button').forEach(btn => {
+    btn.addEventListener('click', e => {
+      const ripple = document.createElement('span');
+      ripple.classList.add('ripple');
+      const rect = btn.getBoundingClientRect();
+      ripple.style.left = `${e.clientX - rect.left}px`;
+      ripple.style.top = `${e.clientY - rect.top}px`;
+      btn.appendChild(ripple);
+      setTimeout(() => ripple.remove(), 600);
+    });
+  });
+
+  // Live updates: append messages pushed by /stream/... in place of reloading
+  const list = document.querySelector('[data-stream]');
+  if (list && window.EventSource) {
+    const isGroup = list.id === 'group-messages';
+    let source = null;
+    let streamUrl = null;
+    let lastId = null;
+    // The stream is told which messages on screen still show "Uploading media…": their update may be
+    // published while no stream is open (between polls), so each connect re-checks them
+    const connect = () => {
+      const url = new URL(list.dataset.stream, window.location.href);
+      if (lastId) url.searchParams.set('after', lastId);
+      const pending = [...list.querySelectorAll('.nexus-media-pending')].map(note => note.closest('[data-message-id]').dataset.messageId);
+      if (pending.length) url.searchParams.set('pending', pending.join(','));
+      if (url.href === streamUrl) return;
+      if (source) source.close();
+      streamUrl = url.href;
+      source = new EventSource(url);
+      source.onmessage = e => {
+        const msg = JSON.parse(e.data);
+        lastId = e.lastEventId;
+        list.appendChild(renderMessage(msg, isGroup));
+        list.scrollTop = list.scrollHeight;
+        if (msg.media_status === 'pending') connect();
+      };
+      // A message already on screen changed, e.g. its background media upload finished
+      source.addEventListener('update', e => {
+        const msg = JSON.parse(e.data);
+        const current = list.querySelector(`[data-message-id="${msg.id}"]`);
+        if (current) current.replaceWith(renderMessage(msg, isGroup));
+        connect();
+      });
+    };
+    connect();
+  }
+
+  // Typeahead: fetch small pages from /users/search instead of listing every user
+  const search = document.querySelector('[data-user-search]');
+  if (search) {
+    const input = search.querySelector('input[name="q"]');
+    const results = search.parentElement.querySelector('.nexus-user-results');
+    const more = search.parentElement.querySelector('.nexus-user-more');
+    let timer = null;
+    let pending = null;
+    const load = async (after) => {
+      const q = input.value.trim();
+      if (pending) pending.abort();
+      if (!after) results.replaceChildren();
+      more.hidden = true;
+      if (!q) return;
+      pending = new AbortController();
+      const params = new URLSearchParams({ q });
+      if (after) params.set('after', after);
+      try {
+        const res = await fetch(`${search.dataset.userSearch}?${params}`, { signal: pending.signal });
+        const page = await res.json();
+        page.users.forEach(user => {
+          const chip = document.createElement('a');
+          chip.className = 'nexus-chip';
+          chip.href = user.url;
+          chip.textContent = user.username;
+          results.appendChild(chip);
+        });
+        if (!after && !page.users.length) results.textContent = `No users match "${q}".`;
+        more.dataset.after = page.next || '';
+        more.hidden = !page.next;
+      } catch (err) {
+        if (err.name !== 'AbortError') console.error('User search failed:', err);
+      }
+    };
+    input.addEventListener('input', () => {
+      clearTimeout(timer);
+      timer = setTimeout(() => load(null), 150);
+    });
+    search.addEventListener('submit', e => {
+      e.preventDefault();
+      clearTimeout(timer);
+      load(null);
+    });
+    more.addEventListener('click', () => load(more.dataset.after));
+  }
+});
+
+function renderMessage(msg, isGroup) {
+  const el = (tag, className) => {
+    const node = document.createElement(tag);
+    if (className) node.className = className;
+    return node;
+  };
+  const wrap = el('div', 'nexus-message ' + (!isGroup && msg.outgoing ? 'outgoing' : 'incoming'));
+  wrap.dataset.messageId = msg.id;
+  const bubble = el('div', 'nexus-bubble');
+  if (isGroup) {
+    const name = el('strong');
+    name.textContent = msg.sender;
+    bubble.appendChild(name);
+  }
+  const text = el('p');
+  text.style.cssText = 'white-space: pre-wrap; margin: var(--spacing-1) 0;';
+  text.textContent = msg.content;
+  bubble.appendChild(text);
+  if (msg.media_status === 'pending' || msg.media_status === 'failed') {
+    const note = el('div', 'nexus-media-preview nexus-media-' + msg.media_status);
+    note.textContent = msg.media_status === 'pending' ? 'Uploading media…' : 'Media upload failed';
+    bubble.appendChild(note);
+  } else if (msg.media) {
+    const preview = el('div', 'nexus-media-preview');
+    const ext = msg.media.split('.').pop().toLowerCase();
+    let media;
+    if (['png', 'jpg', 'jpeg', 'gif'].includes(ext)) {
+      // Show the small preview; the original only loads when clicked
+      media = el('a');
+      media.href = msg.media;
+      media.target = '_blank';
+      const img = el('img');
+      img.alt = 'Media';
+      img.loading = 'lazy';
+      img.src = msg.preview || msg.media;
+      if (msg.preview_size) [img.width, img.height] = msg.preview_size;
+      media.appendChild(img);
+    } else if (['mp4', 'webm', 'mp3', 'wav'].includes(ext)) {
+      media = el(['mp4', 'webm'].includes(ext) ? 'video' : 'audio');
+      media.controls = true;
+      media.preload = 'none';
+      if (msg.preview) media.poster = msg.preview;
+      media.style.maxWidth = '100%';
+      media.src = msg.media;
+    } else {
+      media = el('a');
+      media.href = msg.media;
+      media.target = '_blank';
+      media.textContent = 'Open File';
+    }
+    preview.appendChild(media);
+    bubble.appendChild(preview);
+  }
+  const time = el('span', 'nexus-timestamp');
+  time.textContent = msg.time;
+  bubble.appendChild(time);
+  wrap.appendChild(bubble);
+  return wrap;
+}
+
+async function pasteFromClipboard() {
+  try {
+    const text = await navigator.clipboard.readText();
+    const textarea = document.querySelector('.nexus-textarea');
+    if (textarea) {
+      const start = textarea.selectionStart;
+      const end = textarea.selectionEnd;
+      textarea.value = textarea.value.substring(0, start) + text + textarea.value.substring(end);
+      textarea.selectionStart = textarea.selectionEnd = start + text.length;
+      textarea.focus();
+    }
+  } catch (err) { console.error('Paste failed:', err); }
+}
@@ -0,0 +1,116 @@
+"""Schema upgrades from older databases, each run in a fresh interpreter (app configures itself at import).
+
+    python -m unittest discover tests
+"""
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Schema as the original app's create_all() built it, before any migration existed
+BASELINE_SCHEMA = '''
+CREATE TABLE user (
+    id INTEGER NOT NULL, username VARCHAR(150) NOT NULL, password VARCHAR(150) NOT NULL,
+    PRIMARY KEY (id), UNIQUE (username)
+);
+CREATE TABLE "group" (id INTEGER NOT NULL, name VARCHAR(150) NOT NULL, PRIMARY KEY (id), UNIQUE (name));
+CREATE TABLE message (
+    id INTEGER NOT NULL, sender_id INTEGER NOT NULL, receiver_id INTEGER, group_id INTEGER,
+    content TEXT, media_blob_path VARCHAR(500), timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id),
+    FOREIGN KEY(sender_id) REFERENCES user (id), FOREIGN KEY(receiver_id) REFERENCES user (id),
+    FOREIGN KEY(group_id) REFERENCES "group" (id)
+);
+CREATE TABLE group_member (
+    group_id INTEGER NOT NULL, user_id INTEGER NOT NULL, PRIMARY KEY (group_id, user_id),
+    FOREIGN KEY(group_id) REFERENCES "group" (id), FOREIGN KEY(user_id) REFERENCES user (id)
+);
+INSERT INTO user (id, username, password) VALUES (1, 'alice', 'pw'), (2, 'bob', 'pw');
+INSERT INTO "group" (id, name) VALUES (1, 'g');
+INSERT INTO group_member (group_id, user_id) VALUES (1, 1), (1, 2);
+INSERT INTO message (sender_id, receiver_id, group_id, content, media_blob_path) VALUES
+    (1, 2, NULL, 'old private', NULL),
+    (2, NULL, 1, 'old group', 'https://blob.example/x.png');
+'''
+
+CHILD = '''
+import json, sys
+sys.path.insert(0, %r)
+import app
+with app.app.app_context():
+    conn = app.db.session.connection()
+    print(json.dumps({
+        'version': conn.exec_driver_sql('PRAGMA user_version').scalar(),
+        'migrations': len(app.MIGRATIONS),
+        'conversations': [list(row) for row in conn.exec_driver_sql(
+            'SELECT user_id, kind, peer_id, last_message_id FROM conversation ORDER BY user_id, kind')],
+        'search': [row[0] for row in conn.exec_driver_sql(
+            "SELECT rowid FROM message_fts WHERE message_fts MATCH 'old' ORDER BY rowid")],
+    }))
+''' % ROOT
+
+
+def schema(path):
+    # name -> normalised DDL of every table and index, sqlite's internal ones excepted
+    with sqlite3.connect(path) as conn:
+        rows = conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL")
+        return {name: ' '.join(sql.split()) for name, sql in rows}
+
+
+class MigrationTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix='chat4c-test-')
+
+    def spawn_app(self, name):
+        env = dict(
+            os.environ,
+            DATABASE_URL=f'sqlite:///{self.tmp}/{name}.db',
+            UPLOAD_FOLDER=os.path.join(self.tmp, 'uploads'),
+            TEMPLATE_CACHE_DIR=os.path.join(self.tmp, 'jinja'),
+            MESSAGE_BUS='local',
+            LAZY_INIT='0',
+        )
+        return subprocess.Popen([sys.executable, '-c', CHILD], env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+
+    def wait_app(self, process):
+        stdout, stderr = process.communicate()
+        self.assertEqual(process.returncode, 0, stderr)
+        return json.loads(stdout.strip().splitlines()[-1])  # app prints its DB init line first
+
+    def start_app(self, name):
+        return self.wait_app(self.spawn_app(name))
+
+    def create_baseline(self, name):
+        with sqlite3.connect(os.path.join(self.tmp, f'{name}.db')) as conn:
+            conn.executescript(BASELINE_SCHEMA)
+
+    def test_upgrade_from_baseline(self):
+        self.create_baseline('old')
+        state = self.start_app('old')
+        self.assertEqual(state['version'], state['migrations'])
+        self.assertEqual(state['conversations'], [[1, 'group', 1, 2], [1, 'private', 2, 1], [2, 'group', 1, 2], [2, 'private', 1, 1]])
+        self.assertEqual(state['search'], [1, 2])
+        # An upgraded database ends up with the same indexes as a freshly created one
+        self.start_app('fresh')
+        self.assertEqual(schema(os.path.join(self.tmp, 'old.db')), schema(os.path.join(self.tmp, 'fresh.db')))
+
+    def test_concurrent_upgrade(self):
+        # Workers booting together (gunicorn without --preload) must not each run the migration steps
+        self.create_baseline('shared')
+        processes = [self.spawn_app('shared') for _ in range(8)]
+        states = [self.wait_app(process) for process in processes]
+        self.assertEqual({state['version'] for state in states}, {states[0]['migrations']})
+        self.assertEqual(states[0]['search'], [1, 2])
+
+    def test_restart_on_current_schema(self):
+        first = self.start_app('current')
+        self.assertEqual(self.start_app('current'), first)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+"""Preview generation for uploaded media, run inside a process pool.
+
+Kept free of app/Flask imports so pool workers start quickly, and Pillow is only imported in the
+workers: the app process just checks that it is installed. Images are downscaled with Pillow;
+videos get a poster frame grabbed by ffmpeg. Both are optional: without them no preview is made and
+the templates fall back to the original file.
+"""
+import importlib.util
+import os
+import shutil
+import subprocess
+
+HAS_PIL = importlib.util.find_spec('PIL') is not None  # Optional: image previews
+
+IMAGE_EXTS = {'.png', '.jpg', '.jpeg', '.gif', '.webp'}
+VIDEO_EXTS = {'.mp4', '.webm'}
+
+
+def can_preview(path):
+    ext = os.path.splitext(path)[1].lower()
+    if not HAS_PIL:
+        return False
+    return ext in IMAGE_EXTS or (ext in VIDEO_EXTS and shutil.which('ffmpeg') is not None)
+
+
+def _grab_frame(source, dest):
+    for offset in ('1', '0'):  # Skip a usually-black first frame, unless the clip is shorter than that
+        subprocess.run(
+            ['ffmpeg', '-y', '-loglevel', 'error', '-ss', offset, '-i', source, '-frames:v', '1', dest],
+            check=True, timeout=30,
+        )
+        if os.path.exists(dest) and os.path.getsize(dest):
+            return dest
+    return None
+
+
+def make_preview(source, dest, max_size=480):
+    # Writes a JPEG preview to dest; returns original and preview dimensions, or None if not previewable
+    if not can_preview(source):
+        return None
+    from PIL import Image, ImageOps
+    if os.path.splitext(source)[1].lower() in VIDEO_EXTS:
+        source = _grab_frame(source, dest + '.frame.png')
+        if source is None:
+            return None
+    with Image.open(source) as image:
+        image = ImageOps.exif_transpose(image)
+        width, height = image.size
+        image.thumbnail((max_size, max_size))
+        image.convert('RGB').save(dest, 'JPEG', quality=80, optimize=True, progressive=True)
+        return {
+            'width': width,
+            'height': height,
+            'preview_width': image.width,
+            'preview_height': image.height,
+        }
@@ -0,0 +1,81 @@
+"""Small thread-safe LRU cache with per-entry TTL and hit/miss counters.
+
+Capped by entry count, and optionally by total weight (e.g. approximate bytes) when given a weigher.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+MISSING = object()
+
+
+class TTLCache:
+    def __init__(self, maxsize=1024, ttl=60.0, weigher=None, maxweight=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.weigher = weigher  # value -> weight; None counts every entry as 0
+        self.maxweight = maxweight
+        self.weight = 0
+        self._data = OrderedDict()  # key -> (expires_at, value, weight), least recently used first
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=MISSING, valid=None):
+        # valid(value) -> False treats the entry like an expired one: dropped and counted as a miss
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.monotonic() or (valid is not None and not valid(entry[1])):
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        weight = self.weigher(value) if self.weigher else 0
+        with self._lock:
+            self._remove(key)
+            if self.maxweight is not None and weight > self.maxweight:
+                return  # Would evict everything else and still not fit
+            self._data[key] = (time.monotonic() + self.ttl, value, weight)
+            self.weight += weight
+            while len(self._data) > self.maxsize or (self.maxweight is not None and self.weight > self.maxweight):
+                self._remove(next(iter(self._data)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self.weight -= entry[2]
+
+    def invalidate(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.weight = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            stats = {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+            if self.weigher:
+                stats.update(weight=self.weight, maxweight=self.maxweight)
+            return stats
@@ -0,0 +1,103 @@
+"""Background job queue for media uploads.
+
+Jobs run on a small pool of worker threads. A job whose handler raises is retried with exponential
+backoff (plus jitter) until max_attempts, after which on_failure is called. Threads start lazily in
+each process, so the queue is safe to create at import time under gunicorn --preload.
+"""
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+
+
+class UploadQueue:
+    def __init__(self, handler, on_failure=None, on_start=None, workers=2, max_attempts=5,
+                 base_delay=1.0, max_delay=60.0):
+        self.handler = handler
+        self.on_failure = on_failure
+        self.on_start = on_start
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._heap = []  # (ready_at, seq, attempt, job)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._pid = None
+        self.counters = {'submitted': 0, 'completed': 0, 'retried': 0, 'failed': 0}
+        self.in_flight = 0
+
+    def _ensure_started(self):
+        with self._cond:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._heap = []  # Jobs inherited over fork belong to the parent
+            self.in_flight = 0
+            for _ in range(self.workers):
+                threading.Thread(target=self._work, daemon=True).start()
+        if self.on_start:
+            self.on_start()
+
+    def submit(self, job, delay=0.0, attempt=0):
+        self._ensure_started()
+        with self._cond:
+            heapq.heappush(self._heap, (time.monotonic() + delay, next(self._seq), attempt, job))
+            if not attempt:
+                self.counters['submitted'] += 1
+            self._cond.notify_all()
+
+    def _next_job(self):
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if self._heap and self._heap[0][0] <= now:
+                    _, _, attempt, job = heapq.heappop(self._heap)
+                    self.in_flight += 1
+                    return attempt, job
+                self._cond.wait(self._heap[0][0] - now if self._heap else None)
+
+    def _work(self):
+        while True:
+            attempt, job = self._next_job()
+            try:
+                self.handler(job)
+            except Exception as exc:
+                if attempt + 1 < self.max_attempts:
+                    delay = min(self.max_delay, self.base_delay * 2 ** attempt) * random.uniform(0.5, 1.0)
+                    with self._cond:
+                        self.counters['retried'] += 1
+                    self.submit(job, delay=delay, attempt=attempt + 1)
+                else:
+                    with self._cond:
+                        self.counters['failed'] += 1
+                    if self.on_failure:
+                        self.on_failure(job, exc)
+            else:
+                with self._cond:
+                    self.counters['completed'] += 1
+            finally:
+                with self._cond:
+                    self.in_flight -= 1
+                    self._cond.notify_all()
+
+    def depth(self):
+        with self._cond:
+            return len(self._heap)
+
+    def stats(self):
+        with self._cond:
+            return {'depth': len(self._heap), 'in_flight': self.in_flight, 'workers': self.workers, **self.counters}
+
+    def join(self, timeout=None):
+        # Block until every queued job (including pending retries) has finished; for benchmarks/scripts
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._heap or self.in_flight:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
@@ -0,0 +1,100 @@
+"""Group commit for small database writes.
+
+Items submitted within max_delay of each other (up to max_batch) are handed to flush() together,
+so a burst of messages shares one transaction and one fsync instead of queueing on the SQLite
+write lock one commit at a time. Each submitter gets a Future that resolves only after its batch
+has committed. Like UploadQueue, the writer thread starts lazily in each process.
+"""
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+
+def _percentile(samples, fraction):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class WriteBatcher:
+    def __init__(self, flush, max_batch=64, max_delay=0.005, sample_size=1024):
+        self.flush = flush  # flush(items) -> one result per item (or an exception to fail just that item)
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._pending = deque()  # (submitted_at, item, future)
+        self._cond = threading.Condition()
+        self._pid = None
+        self.counters = {'batches': 0, 'items': 0, 'failed_batches': 0, 'max_batch': 0}
+        self._batch_sizes = deque(maxlen=sample_size)
+        self._latencies = deque(maxlen=sample_size)  # Seconds from submit to commit, per item
+
+    def _ensure_started(self):
+        with self._cond:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._pending.clear()  # Items inherited over fork belong to the parent
+            threading.Thread(target=self._run, daemon=True).start()
+
+    def submit(self, item):
+        self._ensure_started()
+        future = Future()
+        with self._cond:
+            self._pending.append((time.monotonic(), item, future))
+            self._cond.notify()
+        return future
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+            # Hold the batch open until max_delay after its first item, or until it is full
+            deadline = self._pending[0][0] + self.max_delay
+            while len(self._pending) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            count = min(len(self._pending), self.max_batch)
+            return [self._pending.popleft() for _ in range(count)]
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                results = self.flush([item for _, item, _ in batch])
+            except Exception as exc:
+                with self._cond:
+                    self.counters['failed_batches'] += 1
+                for _, _, future in batch:
+                    future.set_exception(exc)
+                continue
+            done = time.monotonic()
+            with self._cond:
+                self.counters['batches'] += 1
+                self.counters['items'] += len(batch)
+                self.counters['max_batch'] = max(self.counters['max_batch'], len(batch))
+                self._batch_sizes.append(len(batch))
+                self._latencies.extend(done - submitted for submitted, _, _ in batch)
+            for (_, _, future), result in zip(batch, results):
+                if isinstance(result, BaseException):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    def stats(self):
+        with self._cond:
+            sizes = list(self._batch_sizes)
+            latencies = list(self._latencies)
+            return {
+                **self.counters,
+                'depth': len(self._pending),
+                'max_delay_ms': self.max_delay * 1000,
+                'mean_batch': round(sum(sizes) / len(sizes), 2) if sizes else 0.0,
+                'latency_ms_p50': round(_percentile(latencies, 0.50) * 1000, 3),
+                'latency_ms_p95': round(_percentile(latencies, 0.95) * 1000, 3),
+                'latency_ms_max': round(max(latencies, default=0.0) * 1000, 3),
+            }